@@ -0,0 +1,105 @@
+"""
+This module provides the in-process read-through caches for meals and per-date menus,
+shared by everything that reads them in a process: the web server, the email receiver
+and mail composition.
+
+Entries are evicted least recently used first once a cache is full, and expire after
+[cache] ttl seconds. The functions in lounasvahti.database that change meals or menus
+invalidate the affected entries explicitly. Other processes' changes reach a cache
+once its entries expire, so the TTL bounds how stale a read can be.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from lounasvahti import config
+
+SIZE = config.getint("cache", "size", fallback=1024)  # Entries per cache
+TTL = config.getfloat("cache", "ttl", fallback=60)  # Seconds, 0 to disable caching
+
+class LRUCache:
+    """
+    Thread-safe LRU cache with a time to live. Values are loaded on a miss with get().
+    A value loaded while the cache was being invalidated is not stored, so a load
+    racing with a write cannot put the old value back.
+    """
+
+    def __init__(self, name, size=None, ttl=None):
+        self.name = name
+        self.size = SIZE if size is None else size
+        self.ttl = TTL if ttl is None else ttl
+        self.entries = OrderedDict()  # key -> (value, expiry time)
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, loader):
+        """
+        Get the value of key, calling loader() to load it on a miss.
+        None is returned as loaded but never stored.
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[1] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self.generation
+
+        value = loader()
+        if value is None or self.ttl <= 0 or self.size <= 0:
+            return value
+
+        with self.lock:
+            if generation == self.generation:
+                self.entries[key] = (value, now + self.ttl)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.size:
+                    self.entries.popitem(last=False)
+        return value
+
+    def invalidate(self, *keys):
+        """Remove the given keys from the cache."""
+        with self.lock:
+            self.generation += 1
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        """Remove the entries for which predicate(key, value) is true."""
+        with self.lock:
+            self.generation += 1
+            for key in [key for key, (value, _) in self.entries.items() if predicate(key, value)]:
+                del self.entries[key]
+
+    def clear(self):
+        """Remove all entries."""
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+        logging.debug(f"Cache {self.name} cleared")
+
+    def stats(self):
+        """Get the number of hits, misses and entries of the cache."""
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.entries)}
+
+# Meals by ID: meal_id -> (name, comment, updated_at)
+meals = LRUCache("meals")
+
+# Menus by restaurant and date: (restaurant, date) -> [(meal_id, name, comment)]
+menus = LRUCache("menus")
+
+def get_cache_stats():
+    """Get the hit and miss counters and sizes of all caches."""
+    return {cache.name: cache.stats() for cache in (meals, menus)}
+
+def clear_caches():
+    """Empty all caches."""
+    meals.clear()
+    menus.clear()
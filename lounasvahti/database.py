@@ -1,256 +1,1128 @@
 """
 This module provides database operations for the Lunch Menu Comment System.
 It includes functions to create and drop tables, manage meals, menus, and subscribers.
+
+Meals by ID and menus by date are read through the in-process caches in lounasvahti.cache,
+and the functions that change them invalidate the affected entries.
+
+Connections are reused per thread (and re-opened after a fork) and configured once
+from the [database] section of config.ini. All queries run inside transaction().
 """
 
+import hashlib
+import json
 import os
+import re
 import sqlite3
 import logging
+import threading
+from contextlib import contextmanager
 
-from lounasvahti import config
-from lounasvahti.utils import sanitize_comment, get_next_week_workdays
+from lounasvahti import cache, config
+from lounasvahti.utils import sanitize_comment, get_monday_and_friday
 
-def get_conn():
-    """Get a connection to the SQLite database."""
-    db_path = os.path.join(config["database"]["path"], "lounasdata.sqlite")
-    return sqlite3.connect(db_path)
+# Per-thread connection state
+_local = threading.local()
 
-def create_db():
-    """Create the database tables."""
-    conn = get_conn()
-    cursor = conn.cursor()
-    
+def _add_restaurant_to_daily_menus(cursor):
+    """
+    Rebuild daily_menus with a restaurant column that is part of the unique key.
+    Existing rows belong to the default restaurant.
+    """
     cursor.execute("""
-    CREATE TABLE IF NOT EXISTS daily_menus (
+    CREATE TABLE daily_menus_new (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
+        restaurant TEXT NOT NULL DEFAULT '',
         date TEXT NOT NULL,
         meal_id INTEGER NOT NULL,
         created_at TEXT DEFAULT CURRENT_TIMESTAMP,
         updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
-        UNIQUE(date, meal_id),
+        UNIQUE(restaurant, date, meal_id),
         FOREIGN KEY (meal_id) REFERENCES meals(id) ON DELETE CASCADE
     );
     """)
-    
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS meals (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT UNIQUE NOT NULL,
-        comment TEXT DEFAULT '',
-        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-        updated_at TEXT DEFAULT CURRENT_TIMESTAMP
-    );
-    """)
-    
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS subscribers (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        email TEXT UNIQUE NOT NULL,
-        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-        updated_at TEXT DEFAULT CURRENT_TIMESTAMP
-    );
-    """)
+    cursor.execute(
+        "INSERT INTO daily_menus_new (id, restaurant, date, meal_id, created_at, updated_at) "
+        "SELECT id, ?, date, meal_id, created_at, updated_at FROM daily_menus",
+        (get_default_restaurant(),)
+    )
+    cursor.execute("DROP TABLE daily_menus")
+    cursor.execute("ALTER TABLE daily_menus_new RENAME TO daily_menus")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_daily_menus_date ON daily_menus(date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_daily_menus_meal_id ON daily_menus(meal_id)")
+
+# Schema migrations, applied in order on top of the tables created by create_db().
+# PRAGMA user_version holds the number of migrations applied to the database, so
+# new migrations must only ever be appended to this list. A migration step is either
+# an SQL statement or a function that takes the cursor.
+MIGRATIONS = [
+    (
+        "Index daily_menus by date",
+        ["CREATE INDEX IF NOT EXISTS idx_daily_menus_date ON daily_menus(date)"],
+    ),
+    (
+        "Index daily_menus by meal_id",
+        ["CREATE INDEX IF NOT EXISTS idx_daily_menus_meal_id ON daily_menus(meal_id)"],
+    ),
+    (
+        "Maintain meals.updated_at",
+        ["""
+        CREATE TRIGGER IF NOT EXISTS meals_updated_at
+        AFTER UPDATE ON meals FOR EACH ROW
+        WHEN NEW.updated_at IS OLD.updated_at
+        BEGIN
+            UPDATE meals SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = NEW.id;
+        END;
+        """],
+    ),
+    (
+        "Full-text search over meal names and comments",
+        [
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS meals_fts USING fts5(
+                name, comment,
+                content='meals', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 0'
+            )
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS meals_fts_insert AFTER INSERT ON meals BEGIN
+                INSERT INTO meals_fts (rowid, name, comment) VALUES (NEW.id, NEW.name, NEW.comment);
+            END;
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS meals_fts_delete AFTER DELETE ON meals BEGIN
+                INSERT INTO meals_fts (meals_fts, rowid, name, comment) VALUES ('delete', OLD.id, OLD.name, OLD.comment);
+            END;
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS meals_fts_update AFTER UPDATE OF name, comment ON meals BEGIN
+                INSERT INTO meals_fts (meals_fts, rowid, name, comment) VALUES ('delete', OLD.id, OLD.name, OLD.comment);
+                INSERT INTO meals_fts (rowid, name, comment) VALUES (NEW.id, NEW.name, NEW.comment);
+            END;
+            """,
+            "INSERT INTO meals_fts (meals_fts) VALUES ('rebuild')",
+        ],
+    ),
+    (
+        "Outbound mail spool",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS mail_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                subject TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                message_id INTEGER NOT NULL,
+                recipient TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                last_error TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (message_id) REFERENCES mail_messages(id) ON DELETE CASCADE
+            );
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_outbox_status_next_attempt ON outbox(status, next_attempt_at)",
+            "CREATE INDEX IF NOT EXISTS idx_outbox_message_id ON outbox(message_id)",
+        ],
+    ),
+    (
+        "Pre-rendered mail artifacts",
+        ["""
+        CREATE TABLE IF NOT EXISTS mail_artifacts (
+            kind TEXT NOT NULL,
+            date TEXT NOT NULL,
+            content TEXT NOT NULL,
+            source_version TEXT NOT NULL,
+            rendered_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (kind, date)
+        );
+        """],
+    ),
+    (
+        "Menus per restaurant",
+        [_add_restaurant_to_daily_menus],
+    ),
+    (
+        "Menu content hashes and change log",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS menu_hashes (
+                restaurant TEXT NOT NULL,
+                date TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (restaurant, date)
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS menu_changes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                restaurant TEXT NOT NULL,
+                date TEXT NOT NULL,
+                added TEXT NOT NULL,
+                removed TEXT NOT NULL,
+                changed_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                notified_at TEXT
+            );
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_menu_changes_pending ON menu_changes(notified_at, restaurant, date)",
+        ],
+    ),
+    (
+        "Delivery log and subscriber bounces",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS deliveries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                recipient TEXT NOT NULL,
+                subject TEXT,
+                status TEXT NOT NULL,
+                smtp_code INTEGER,
+                error TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            );
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_deliveries_recipient ON deliveries(recipient, created_at)",
+            "CREATE INDEX IF NOT EXISTS idx_deliveries_created_at ON deliveries(created_at)",
+            "ALTER TABLE subscribers ADD COLUMN bounces INTEGER NOT NULL DEFAULT 0",
+            "ALTER TABLE subscribers ADD COLUMN suspended_at TEXT",
+        ],
+    ),
+]
+
+def get_default_restaurant():
+    """Get the name of the default restaurant, the one configured in [target]. Mails show its menus."""
+    return config.get("target", "name", fallback="")
+
+def get_db_path():
+    """Get the path of the SQLite database file."""
+    return os.path.join(config["database"]["path"], "lounasdata.sqlite")
+
+def _configure_conn(conn):
+    """Apply the connection settings from config.ini to a new connection."""
+    busy_timeout = config.getint("database", "busy_timeout", fallback=5000)
+    journal_mode = config.get("database", "journal_mode", fallback="WAL")
+    synchronous = config.get("database", "synchronous", fallback="NORMAL")
+    cache_size = config.getint("database", "cache_size", fallback=-16000)
+    mmap_size = config.getint("database", "mmap_size", fallback=134217728)
+
+    # busy_timeout first, so that switching the journal mode waits for other writers too
+    conn.execute(f"PRAGMA busy_timeout = {busy_timeout}")
+    conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+    conn.execute(f"PRAGMA synchronous = {synchronous}")
+    conn.execute(f"PRAGMA cache_size = {cache_size}")
+    conn.execute(f"PRAGMA mmap_size = {mmap_size}")
+    conn.execute("PRAGMA foreign_keys = ON")
+
+def get_conn():
+    """
+    Get this thread's connection to the SQLite database.
+    The connection is opened and configured on first use and reused afterwards.
+    A connection inherited over fork() is never reused by the child.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.pid == os.getpid():
+        return conn
+
+    # isolation_level=None: transactions are managed explicitly by transaction()
+    conn = sqlite3.connect(get_db_path(), isolation_level=None, check_same_thread=False)
+    _configure_conn(conn)
+    _local.conn = conn
+    _local.pid = os.getpid()
+    _local.depth = 0
+    logging.debug(f"Opened database connection in process {_local.pid}.")
+    return conn
+
+def close_conn():
+    """Close this thread's connection to the database, if one is open."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        return
+    if _local.pid == os.getpid():
+        conn.close()
+    _local.conn = None
+    logging.debug("Closed database connection.")
+
+@contextmanager
+def transaction(immediate=False):
+    """
+    Run a block of statements in a single transaction and yield a cursor.
+    Commits when the block exits normally and rolls back on an exception.
+    Nested calls join the outermost transaction.
+
+    :param immediate: Take the write lock up front (BEGIN IMMEDIATE). Use this for
+                      writes so that concurrent writers queue on busy_timeout instead
+                      of failing to upgrade a read lock.
+    """
+    conn = get_conn()
+    if _local.depth > 0:
+        _local.depth += 1
+        try:
+            yield conn.cursor()
+        finally:
+            _local.depth -= 1
+        return
+
+    conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    _local.depth = 1
+    try:
+        yield conn.cursor()
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        _local.depth = 0
+
+def create_db():
+    """Create the database tables."""
+    with transaction(immediate=True) as cursor:
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS daily_menus (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT NOT NULL,
+            meal_id INTEGER NOT NULL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(date, meal_id),
+            FOREIGN KEY (meal_id) REFERENCES meals(id) ON DELETE CASCADE
+        );
+        """)
+
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS meals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            comment TEXT DEFAULT '',
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        );
+        """)
+
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS subscribers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT UNIQUE NOT NULL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        );
+        """)
 
-    conn.commit()
-    conn.close()
     logging.info("Database tables created successfully.")
+    migrate()
+
+def get_schema_version():
+    """Get the number of migrations applied to the database."""
+    with transaction() as cursor:
+        cursor.execute("PRAGMA user_version")
+        return cursor.fetchone()[0]
+
+def migrate():
+    """
+    Apply pending schema migrations. Each migration runs in its own transaction
+    together with the user_version bump, so an interrupted run can simply be repeated.
+
+    :return: The schema version after migrating
+    """
+    version = get_schema_version()
+    if version > len(MIGRATIONS):
+        logging.warning(f"Database schema version {version} is newer than this code ({len(MIGRATIONS)}).")
+        return version
+
+    for number, (description, statements) in enumerate(MIGRATIONS[version:], start=version + 1):
+        logging.info(f"Applying migration {number}: {description}")
+        with transaction(immediate=True) as cursor:
+            for statement in statements:
+                if callable(statement):
+                    statement(cursor)
+                else:
+                    cursor.execute(statement)
+            cursor.execute(f"PRAGMA user_version = {number}")
+        version = number
+
+    logging.info(f"Database schema is at version {version}.")
+    return version
 
 def drop_db():
     """Drop all the database tables."""
-    conn = get_conn()
-    cursor = conn.cursor()
-    
-    cursor.execute("DROP TABLE IF EXISTS daily_menus")
-    cursor.execute("DROP TABLE IF EXISTS meals")
-    cursor.execute("DROP TABLE IF EXISTS subscribers")
-    
-    conn.commit()
-    conn.close()
+    with transaction(immediate=True) as cursor:
+        cursor.execute("DROP TABLE IF EXISTS daily_menus")
+        cursor.execute("DROP TABLE IF EXISTS meals")
+        cursor.execute("DROP TABLE IF EXISTS meals_fts")
+        cursor.execute("DROP TABLE IF EXISTS subscribers")
+        cursor.execute("DROP TABLE IF EXISTS outbox")
+        cursor.execute("DROP TABLE IF EXISTS mail_messages")
+        cursor.execute("DROP TABLE IF EXISTS mail_artifacts")
+        cursor.execute("DROP TABLE IF EXISTS menu_hashes")
+        cursor.execute("DROP TABLE IF EXISTS menu_changes")
+        cursor.execute("DROP TABLE IF EXISTS deliveries")
+        cursor.execute("PRAGMA user_version = 0")
+    cache.clear_caches()
+
     logging.info("Database tables dropped successfully.")
 
 def get_or_create_meal(name):
     """Get or create a meal by name."""
-    conn = get_conn()
-    cursor = conn.cursor()
+    with transaction(immediate=True) as cursor:
+        cursor.execute(
+            "INSERT INTO meals (name, comment) VALUES (?, NULL) "
+            "ON CONFLICT(name) DO NOTHING;",
+            (name,)
+        )
 
-    cursor.execute(
-        "INSERT INTO meals (name, comment) VALUES (?, NULL) "
-        "ON CONFLICT(name) DO NOTHING;",
-        (name,)
-    )
-
-    cursor.execute("SELECT id FROM meals WHERE name = ?", (name,))
-    meal_id = cursor.fetchone()[0]
+        cursor.execute("SELECT id FROM meals WHERE name = ?", (name,))
+        meal_id = cursor.fetchone()[0]
 
-    conn.commit()
-    conn.close()
     logging.debug(f"Meal '{name}' retrieved or created with ID {meal_id}.")
 
     return meal_id
 
-def get_meal_by_id(id):
-    """Fetch a meal by ID. Returns None if it doesn't exist."""
-    conn = get_conn()
-    cursor = conn.cursor()
+def _invalidate_meal(meal_id):
+    """Drop a meal and the menus it is on from the caches."""
+    cache.meals.invalidate(meal_id)
+    cache.menus.invalidate_where(lambda key, menu: any(row[0] == meal_id for row in menu))
 
-    cursor.execute("SELECT name, comment FROM meals WHERE id = ?", (id,))
-    meal = cursor.fetchone()
+def _load_meal(id):
+    """Fetch a meal by ID from the database."""
+    with transaction() as cursor:
+        cursor.execute("SELECT name, comment, updated_at FROM meals WHERE id = ?", (id,))
+        meal = cursor.fetchone()
 
-    conn.close()
     logging.info(f"Meal with ID {id} fetched: {meal}.")
 
-    return meal  # Returns (name, comment) or None if meal not found
+    return meal
+
+def get_meal_record(id, updated_at=None):
+    """
+    Fetch a meal by ID, through the meal cache.
+    Returns (name, comment, updated_at) or None if the meal doesn't exist.
+
+    :param updated_at: The meal's current update time, e.g. from get_meal_updated_at().
+                       A cached copy with another update time, changed by another
+                       process, is dropped and the meal fetched again.
+    """
+    try:
+        id = int(id)
+    except (TypeError, ValueError):
+        return None
+
+    meal = cache.meals.get(id, lambda: _load_meal(id))
+    if meal and updated_at is not None and meal[2] != updated_at:
+        logging.debug(f"Cached meal with ID {id} is stale, fetching it again.")
+        _invalidate_meal(id)
+        meal = cache.meals.get(id, lambda: _load_meal(id))
+    return meal
+
+def get_meal_by_id(id):
+    """Fetch a meal by ID, through the meal cache. Returns None if it doesn't exist."""
+    meal = get_meal_record(id)
+
+    return meal[:2] if meal else None  # Returns (name, comment) or None if meal not found
+
+def get_meal_updated_at(id):
+    """
+    Get the time a meal was last updated, in UTC, with a primary key lookup that bypasses
+    the meal cache. Returns None if the meal doesn't exist.
+    """
+    with transaction() as cursor:
+        cursor.execute("SELECT updated_at FROM meals WHERE id = ?", (id,))
+        row = cursor.fetchone()
+
+    return row[0] if row else None
 
 def get_meal_by_name(name):
     """Fetch a meal by name. Returns None if it doesn't exist."""
-    conn = get_conn()
-    cursor = conn.cursor()
+    with transaction() as cursor:
+        cursor.execute("SELECT id, comment FROM meals WHERE name = ?", (name,))
+        meal = cursor.fetchone()
 
-    cursor.execute("SELECT id, comment FROM meals WHERE name = ?", (name,))
-    meal = cursor.fetchone()
-
-    conn.close()
     logging.info(f"Meal with name '{name}' fetched: {meal}.")
 
     return meal  # Returns (id, comment) or None if meal not found
 
-def create_menu_item(date, name):
-    """Create a menu item for a specific date."""
-    conn = get_conn()
-    cursor = conn.cursor()
+def create_menu_item(date, name, restaurant=None):
+    """Create a menu item for a specific date, for the default restaurant unless another is given."""
+    restaurant = restaurant or get_default_restaurant()
+    with transaction(immediate=True) as cursor:
+        meal_id = get_or_create_meal(name)
 
-    meal_id = get_or_create_meal(name)
+        cursor.execute(
+            "INSERT INTO daily_menus (restaurant, date, meal_id) VALUES (?, ?, ?) "
+            "ON CONFLICT(restaurant, date, meal_id) DO NOTHING;",
+            (restaurant, date, meal_id)
+        )
+    cache.menus.invalidate((restaurant, date))
 
-    cursor.execute(
-        "INSERT INTO daily_menus (date, meal_id) VALUES (?, ?) "
-        "ON CONFLICT(date, meal_id) DO NOTHING;",
-        (date, meal_id)
+    logging.debug(f"Menu item for date {date} and meal '{name}' created.")
+
+def _menu_hash(items):
+    """Content hash of one day's menu items, as parsed from its DayDataPanel."""
+    return hashlib.sha256("\n".join(items).encode("utf-8")).hexdigest()
+
+def store_menu(menu, restaurant=None):
+    """
+    Store a scraped menu in a single transaction, writing only what changed.
+    Each day's items are hashed; days whose hash matches the stored one are skipped.
+    For the other days, removed items are deleted and added ones inserted, and
+    changes to a day that already had a menu are recorded in menu_changes.
+
+    :param menu: Dict mapping ISO dates to lists of meal names, as returned by Scraper.get_menus()
+    :param restaurant: Name of the restaurant the menu is for, the default restaurant if not given
+    :return: Dict with the numbers of menu rows "inserted" and "removed", the number of
+             "unchanged" days and the list of "changed" dates whose existing menu changed
+    """
+    restaurant = restaurant or get_default_restaurant()
+    result = {"inserted": 0, "removed": 0, "unchanged": 0, "changed": []}
+    # Deduplicate while preserving order
+    days = {date: list(dict.fromkeys(items)) for date, items in menu.items()}
+    if not days:
+        logging.info("Empty menu, nothing to store.")
+        return result
+    hashes = {date: _menu_hash(items) for date, items in days.items()}
+
+    with transaction(immediate=True) as cursor:
+        cursor.execute(
+            "SELECT date, hash FROM menu_hashes "
+            "WHERE restaurant = ? AND date IN (SELECT value FROM json_each(?))",
+            (restaurant, json.dumps(list(days)))
+        )
+        stored_hashes = dict(cursor.fetchall())
+        dirty = [date for date in days if stored_hashes.get(date) != hashes[date]]
+        result["unchanged"] = len(days) - len(dirty)
+        if not dirty:
+            logging.info(f"Menu for {restaurant} unchanged, nothing to store.")
+            return result
+
+        names = list(dict.fromkeys(name for date in dirty for name in days[date]))
+        cursor.executemany(
+            "INSERT INTO meals (name, comment) VALUES (?, NULL) "
+            "ON CONFLICT(name) DO NOTHING;",
+            [(name,) for name in names]
+        )
+        cursor.execute(
+            "SELECT name, id FROM meals WHERE name IN (SELECT value FROM json_each(?))",
+            (json.dumps(names),)
+        )
+        meal_ids = dict(cursor.fetchall())
+
+        cursor.execute(
+            "SELECT daily_menus.date, daily_menus.meal_id, meals.name FROM daily_menus "
+            "JOIN meals ON daily_menus.meal_id = meals.id "
+            "WHERE restaurant = ? AND date IN (SELECT value FROM json_each(?))",
+            (restaurant, json.dumps(dirty))
+        )
+        existing = {date: {} for date in dirty}
+        for date, meal_id, name in cursor.fetchall():
+            existing[date][meal_id] = name
+
+        inserts, deletes, changes = [], [], []
+        for date in dirty:
+            old = existing[date]
+            new = {meal_ids[name]: name for name in days[date]}
+            added = [meal_id for meal_id in new if meal_id not in old]
+            removed = [meal_id for meal_id in old if meal_id not in new]
+            inserts += [(restaurant, date, meal_id) for meal_id in added]
+            deletes += [(restaurant, date, meal_id) for meal_id in removed]
+            if old and (added or removed):
+                changes.append((
+                    restaurant, date,
+                    json.dumps([new[meal_id] for meal_id in added], ensure_ascii=False),
+                    json.dumps([old[meal_id] for meal_id in removed], ensure_ascii=False),
+                ))
+
+        cursor.executemany(
+            "DELETE FROM daily_menus WHERE restaurant = ? AND date = ? AND meal_id = ?",
+            deletes
+        )
+        cursor.executemany(
+            "INSERT INTO daily_menus (restaurant, date, meal_id) VALUES (?, ?, ?)",
+            inserts
+        )
+        cursor.executemany(
+            "INSERT INTO menu_changes (restaurant, date, added, removed) VALUES (?, ?, ?, ?)",
+            changes
+        )
+        cursor.executemany(
+            "INSERT INTO menu_hashes (restaurant, date, hash) VALUES (?, ?, ?) "
+            "ON CONFLICT(restaurant, date) DO UPDATE SET hash = excluded.hash, updated_at = CURRENT_TIMESTAMP",
+            [(restaurant, date, hashes[date]) for date in dirty]
+        )
+    cache.menus.invalidate(*[(restaurant, date) for date in dirty])
+
+    result.update(inserted=len(inserts), removed=len(deletes), changed=[change[1] for change in changes])
+    logging.info(
+        f"Menu for {restaurant} stored: {result['inserted']} rows inserted, {result['removed']} removed, "
+        f"{result['unchanged']} days unchanged, {len(changes)} days changed."
     )
 
-    conn.commit()
-    conn.close()
-    logging.debug(f"Menu item for date {date} and meal '{name}' created.")
+    return result
+
+def get_pending_menu_changes(restaurant=None, from_date=None):
+    """
+    Get menu changes that have not been notified yet.
+
+    :param restaurant: Name of the restaurant, the default restaurant if not given
+    :param from_date: Only include changes to menus on or after this ISO date
+    :return: List of (change_id, date, added, removed) tuples, added and removed being lists of meal names
+    """
+    restaurant = restaurant or get_default_restaurant()
+    with transaction() as cursor:
+        cursor.execute(
+            "SELECT id, date, added, removed FROM menu_changes "
+            "WHERE notified_at IS NULL AND restaurant = ? AND date >= ? ORDER BY date, id",
+            (restaurant, from_date or "")
+        )
+        rows = cursor.fetchall()
+
+    return [(change_id, date, json.loads(added), json.loads(removed)) for change_id, date, added, removed in rows]
+
+def mark_menu_changes_notified(change_ids=None, before_date=None):
+    """
+    Mark menu changes as notified.
+
+    :param change_ids: IDs of the changes to mark
+    :param before_date: Also mark all pending changes to menus before this ISO date
+    """
+    with transaction(immediate=True) as cursor:
+        if change_ids:
+            cursor.execute(
+                "UPDATE menu_changes SET notified_at = CURRENT_TIMESTAMP "
+                "WHERE id IN (SELECT value FROM json_each(?))",
+                (json.dumps(list(change_ids)),)
+            )
+        if before_date:
+            cursor.execute(
+                "UPDATE menu_changes SET notified_at = CURRENT_TIMESTAMP "
+                "WHERE notified_at IS NULL AND date < ?",
+                (before_date,)
+            )
 
 def update_meal_comment(meal_id, new_comment):
     """Update the comment for a meal, logging a warning if HTML is detected."""
-    conn = get_conn()
-    cursor = conn.cursor()
-
     safe_comment = sanitize_comment(new_comment)
 
-    cursor.execute("UPDATE meals SET comment = ? WHERE id = ?", (safe_comment, meal_id))
-    conn.commit()
-    conn.close()
+    with transaction(immediate=True) as cursor:
+        cursor.execute("UPDATE meals SET comment = ? WHERE id = ?", (safe_comment, meal_id))
+    _invalidate_meal(int(meal_id))
+
     logging.debug(f"Comment for meal ID {meal_id} updated.")
 
 def update_meal_name(old_name, new_name):
     """Update the name of a meal."""
-    conn = get_conn()
-    cursor = conn.cursor()
+    with transaction(immediate=True) as cursor:
+        cursor.execute(
+            "UPDATE meals SET name = ? WHERE name = ? RETURNING id",
+            (new_name, old_name)
+        )
+        meal_ids = [row[0] for row in cursor.fetchall()]
+    for meal_id in meal_ids:
+        _invalidate_meal(meal_id)
 
-    cursor.execute(
-        "UPDATE meals SET name = ? WHERE name = ?",
-        (new_name, old_name)
-    )
-
-    conn.commit()
-    conn.close()
     logging.debug(f"Meal name updated from '{old_name}' to '{new_name}'.")
 
-def get_menu(date):
-    """Get the menu for a specific date."""
-    conn = get_conn()
-    cursor = conn.cursor()
-
-    cursor.execute(
-        "SELECT meals.id, meals.name, meals.comment FROM daily_menus "
-        "JOIN meals ON daily_menus.meal_id = meals.id "
-        "WHERE date = ?",
-        (date,)
-    )
+def _load_menu(date, restaurant):
+    """Fetch the menu of a restaurant for a date from the database."""
+    with transaction() as cursor:
+        cursor.execute(
+            "SELECT meals.id, meals.name, meals.comment FROM daily_menus "
+            "JOIN meals ON daily_menus.meal_id = meals.id "
+            "WHERE restaurant = ? AND date = ?",
+            (restaurant, date)
+        )
 
-    menu = cursor.fetchall()
+        menu = cursor.fetchall()
 
-    conn.close()
     logging.debug(f"Menu for date {date} fetched: {menu}.")
 
     return menu
 
-def add_subscriber(email):
-    """Add a new subscriber."""
-    conn = get_conn()
-    cursor = conn.cursor()
+def get_menu(date, restaurant=None):
+    """
+    Get the menu for a specific date, for the default restaurant unless another is given.
+    Read through the menu cache.
+    """
+    restaurant = restaurant or get_default_restaurant()
+    return list(cache.menus.get((restaurant, date), lambda: _load_menu(date, restaurant)))
 
-    cursor.execute(
-        "INSERT INTO subscribers (email) VALUES (?) "
-        "ON CONFLICT(email) DO NOTHING;",
-        (email,)
-    )
+def get_menus_between(start, end, restaurant=None):
+    """
+    Get the menus for all dates between start and end (inclusive) with a single query.
+
+    :param start: First date in ISO format (YYYY-MM-DD)
+    :param end: Last date in ISO format (YYYY-MM-DD)
+    :param restaurant: Name of the restaurant, the default restaurant if not given
+    :return: Dict mapping dates in ascending order to lists of (id, name, comment) tuples.
+             Dates without a menu are omitted.
+    """
+    restaurant = restaurant or get_default_restaurant()
+    with transaction() as cursor:
+        cursor.execute(
+            "SELECT daily_menus.date, meals.id, meals.name, meals.comment FROM daily_menus "
+            "JOIN meals ON daily_menus.meal_id = meals.id "
+            "WHERE restaurant = ? AND date BETWEEN ? AND ? "
+            "ORDER BY daily_menus.date, daily_menus.id",
+            (restaurant, start, end)
+        )
+
+        menus = {}
+        for date, meal_id, name, comment in cursor.fetchall():
+            menus.setdefault(date, []).append((meal_id, name, comment))
+
+    logging.debug(f"Menus between {start} and {end} fetched for {len(menus)} dates.")
+
+    return menus
+
+def get_menu_rows(start, end, restaurant=None, after=None, limit=100):
+    """
+    Get a page of the menu rows between start and end (inclusive) with a single range query,
+    in date order. Pages are keyset paginated: pass the key of the last row of a page
+    as after to get the next page.
+
+    :param start: First date in ISO format (YYYY-MM-DD)
+    :param end: Last date in ISO format (YYYY-MM-DD)
+    :param restaurant: Name of the restaurant, the default restaurant if not given
+    :param after: Key (date, row_id) of the row the page starts after, None for the first page
+    :param limit: Maximum number of rows
+    :return: List of (date, row_id, meal_id, name, comment) tuples
+    """
+    restaurant = restaurant or get_default_restaurant()
+    after_date, after_id = after or ("", 0)
+    with transaction() as cursor:
+        cursor.execute(
+            "SELECT daily_menus.date, daily_menus.id, meals.id, meals.name, meals.comment FROM daily_menus "
+            "JOIN meals ON daily_menus.meal_id = meals.id "
+            "WHERE restaurant = ? AND date BETWEEN ? AND ? AND (daily_menus.date, daily_menus.id) > (?, ?) "
+            "ORDER BY daily_menus.date, daily_menus.id LIMIT ?",
+            (restaurant, start, end, after_date, after_id, limit)
+        )
+        rows = cursor.fetchall()
+
+    logging.debug(f"{len(rows)} menu rows between {start} and {end} fetched after {after}.")
+
+    return rows
+
+def has_menu_between(start, end, restaurant=None):
+    """
+    Check if there is a menu for any date between start and end (inclusive),
+    for the default restaurant unless another is given.
+    """
+    restaurant = restaurant or get_default_restaurant()
+    with transaction() as cursor:
+        cursor.execute(
+            "SELECT EXISTS (SELECT 1 FROM daily_menus WHERE restaurant = ? AND date BETWEEN ? AND ?)",
+            (restaurant, start, end)
+        )
+        found = bool(cursor.fetchone()[0])
+
+    logging.debug(f"Menu between {start} and {end} found: {found}.")
+
+    return found
+
+def _fts_query(query):
+    """
+    Turn free text into an FTS5 query that matches all words as prefixes.
+    Every word is quoted, so user input can never be a syntax error.
+    """
+    words = re.findall(r"\w+", query)
+    return " ".join(f'"{word}"*' for word in words)
+
+def search_meals(query, limit=20, offset=0):
+    """
+    Search meals by name and comment, best matches first.
+
+    :param query: Free text search; every word must match the start of a word in the name or comment
+    :param limit: Maximum number of results
+    :param offset: Number of results to skip, for pagination
+    :return: List of (id, name, comment) tuples
+    """
+    fts_query = _fts_query(query)
+    if not fts_query:
+        return []
+
+    with transaction() as cursor:
+        cursor.execute(
+            "SELECT meals.id, meals.name, meals.comment FROM meals_fts "
+            "JOIN meals ON meals.id = meals_fts.rowid "
+            "WHERE meals_fts MATCH ? "
+            "ORDER BY meals_fts.rank LIMIT ? OFFSET ?",
+            (fts_query, limit, offset)
+        )
+        meals = cursor.fetchall()
+
+    logging.debug(f"Search for '{query}' returned {len(meals)} meals.")
+
+    return meals
+
+def get_menu_version(start, end, restaurant=None):
+    """
+    Get a version string for the menus between start and end (inclusive).
+    It changes whenever a menu row is added or removed, or a meal on the menus
+    is updated, so it can be used to tell whether a rendering is stale.
+    """
+    restaurant = restaurant or get_default_restaurant()
+    with transaction() as cursor:
+        cursor.execute(
+            "SELECT COUNT(*), MAX(meals.updated_at), MAX(daily_menus.created_at) FROM daily_menus "
+            "JOIN meals ON daily_menus.meal_id = meals.id "
+            "WHERE restaurant = ? AND date BETWEEN ? AND ?",
+            (restaurant, start, end)
+        )
+        count, meals_updated_at, menus_created_at = cursor.fetchone()
+
+    return f"{count}|{meals_updated_at}|{menus_created_at}"
+
+def get_mail_artifact(kind, date):
+    """Fetch a pre-rendered mail. Returns (content, source_version) or None."""
+    with transaction() as cursor:
+        cursor.execute(
+            "SELECT content, source_version FROM mail_artifacts WHERE kind = ? AND date = ?",
+            (kind, date)
+        )
+        return cursor.fetchone()
+
+def save_mail_artifact(kind, date, content, source_version):
+    """Store a pre-rendered mail, replacing any previous rendering."""
+    with transaction(immediate=True) as cursor:
+        cursor.execute(
+            "INSERT INTO mail_artifacts (kind, date, content, source_version) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(kind, date) DO UPDATE SET content = excluded.content, "
+            "source_version = excluded.source_version, rendered_at = CURRENT_TIMESTAMP",
+            (kind, date, content, source_version)
+        )
+
+    logging.debug(f"Mail artifact {kind} for {date} saved.")
+
+def remove_mail_artifacts_before_date(date):
+    """Remove pre-rendered mails for dates before a specific date."""
+    with transaction(immediate=True) as cursor:
+        cursor.execute("DELETE FROM mail_artifacts WHERE date < ?", (date,))
+
+    logging.debug(f"Mail artifacts before date {date} removed.")
+
+def add_subscriber(email):
+    """Add a new subscriber. An existing subscriber's bounce count and suspension are cleared."""
+    with transaction(immediate=True) as cursor:
+        cursor.execute(
+            "INSERT INTO subscribers (email) VALUES (?) "
+            "ON CONFLICT(email) DO UPDATE SET bounces = 0, suspended_at = NULL, "
+            "updated_at = CURRENT_TIMESTAMP;",
+            (email,)
+        )
 
-    conn.commit()
-    conn.close()
     logging.info(f"Subscriber with email '{email}' added.")
 
 def remove_subscriber(email):
     """Remove a subscriber."""
-    conn = get_conn()
-    cursor = conn.cursor()
-
-    cursor.execute(
-        "DELETE FROM subscribers WHERE email = ?",
-        (email,)
-    )
+    with transaction(immediate=True) as cursor:
+        cursor.execute(
+            "DELETE FROM subscribers WHERE email = ?",
+            (email,)
+        )
 
-    conn.commit()
-    conn.close()
     logging.info(f"Subscriber with email '{email}' removed.")
 
 def get_subscribers():
-    """Get all subscribers."""
-    conn = get_conn()
-    cursor = conn.cursor()
+    """Get all subscribers that are not suspended."""
+    with transaction() as cursor:
+        cursor.execute("SELECT email FROM subscribers WHERE suspended_at IS NULL")
 
-    cursor.execute("SELECT email FROM subscribers")
+        emails = [row[0] for row in cursor.fetchall()]
 
-    emails = [row[0] for row in cursor.fetchall()]
-    
-    conn.close()
     logging.debug("Subscribers fetched.")
     return emails
 
-def remove_menu_item(date):
-    """Remove a menu item for a specific date."""
-    conn = get_conn()
-    cursor = conn.cursor()
+def get_suspended_subscribers():
+    """Get the subscribers suspended for bouncing, as (email, bounces, suspended_at) tuples."""
+    with transaction() as cursor:
+        cursor.execute(
+            "SELECT email, bounces, suspended_at FROM subscribers "
+            "WHERE suspended_at IS NOT NULL ORDER BY suspended_at"
+        )
+        return cursor.fetchall()
 
+def _count_bounces(cursor, emails, limit):
+    """Count a hard bounce for each of emails and suspend the subscribers that reach limit."""
+    cursor.executemany(
+        "UPDATE subscribers SET bounces = bounces + 1, updated_at = CURRENT_TIMESTAMP WHERE email = ?",
+        [(email,) for email in emails]
+    )
     cursor.execute(
-        "DELETE FROM daily_menus WHERE date = ?",
-        (date,)
+        "UPDATE subscribers SET suspended_at = CURRENT_TIMESTAMP "
+        "WHERE suspended_at IS NULL AND bounces >= ? AND email IN (SELECT value FROM json_each(?)) "
+        "RETURNING email",
+        (limit, json.dumps(list(emails)))
     )
+    suspended = [row[0] for row in cursor.fetchall()]
+    if suspended:
+        logging.warning(f"Subscribers suspended after {limit} hard bounces: {', '.join(suspended)}")
+    return suspended
+
+def record_bounces(bounces, limit):
+    """
+    Record hard bounces reported by bounce messages. Subscribers with limit or more hard
+    bounces are suspended: they stay subscribed, but get no mail until they subscribe again.
+
+    :param bounces: List of (email, smtp_code, error) tuples, smtp_code being None if unknown
+    :param limit: Number of hard bounces after which a subscriber is suspended
+    :return: List of the email addresses suspended now
+    """
+    if not bounces:
+        return []
+
+    with transaction(immediate=True) as cursor:
+        cursor.executemany(
+            "INSERT INTO deliveries (recipient, status, smtp_code, error) VALUES (?, 'bounced', ?, ?)",
+            bounces
+        )
+        suspended = _count_bounces(cursor, [email for email, _, _ in bounces], limit)
+
+    logging.info(f"Recorded {len(bounces)} bounces, suspended {len(suspended)} subscribers.")
+
+    return suspended
+
+def remove_menu_item(date):
+    """Remove a menu item for a specific date."""
+    with transaction(immediate=True) as cursor:
+        cursor.execute(
+            "DELETE FROM daily_menus WHERE date = ?",
+            (date,)
+        )
+        # Forget the hash too, so the next scrape stores the day again
+        cursor.execute("DELETE FROM menu_hashes WHERE date = ?", (date,))
+    cache.menus.invalidate_where(lambda key, menu: key[1] == date)
 
-    conn.commit()
-    conn.close()
     logging.info(f"Menu item for date {date} removed.")
 
 def remove_menu_items_before_date(date):
     """Remove menu items before a specific date."""
-    conn = get_conn()
-    cursor = conn.cursor()
+    with transaction(immediate=True) as cursor:
+        cursor.execute(
+            "DELETE FROM daily_menus WHERE date < ?",
+            (date,)
+        )
+        cursor.execute("DELETE FROM menu_hashes WHERE date < ?", (date,))
+        cursor.execute("DELETE FROM menu_changes WHERE date < ?", (date,))
+    cache.menus.invalidate_where(lambda key, menu: key[1] < date)
 
-    cursor.execute(
-        "DELETE FROM daily_menus WHERE date < ?",
-        (date,)
-    )
-
-    conn.commit()
-    conn.close()
     logging.info(f"Menu items before date {date} removed.")
 
 def have_menu_for_next_week():
-    """Check if there is a menu for the next week."""
-    for day in get_next_week_workdays():
-        if get_menu(day):
-            logging.debug("Menu found for next week.")
-            return True
-    logging.debug("No menu found for next week.")
-    return False
+    """Check if there is a menu for the next week at the default restaurant."""
+    found = has_menu_between(*get_monday_and_friday())
+    if found:
+        logging.debug("Menu found for next week.")
+    else:
+        logging.debug("No menu found for next week.")
+    return found
+
+def enqueue_mail(subject, content, recipients):
+    """
+    Add a composed email to the outbound mail spool.
+
+    :param subject: The subject of the email
+    :param content: The HTML content of the email
+    :param recipients: A recipient email address or a list of them
+    :return: ID of the spooled message
+    """
+    if isinstance(recipients, str):
+        recipients = [recipients]
+    recipients = list(dict.fromkeys(recipients))
+
+    with transaction(immediate=True) as cursor:
+        cursor.execute(
+            "INSERT INTO mail_messages (subject, content) VALUES (?, ?)",
+            (subject, content)
+        )
+        message_id = cursor.lastrowid
+        cursor.executemany(
+            "INSERT INTO outbox (message_id, recipient) VALUES (?, ?)",
+            [(message_id, recipient) for recipient in recipients]
+        )
+
+    logging.info(f"Mail '{subject}' queued for {len(recipients)} recipients with ID {message_id}.")
+
+    return message_id
+
+def claim_outbox(limit, lease):
+    """
+    Claim queued outbox entries that are due for sending. Claimed entries are not due
+    again until the lease expires, so a crashed drain does not lose them and concurrent
+    drains do not send them twice.
+
+    :param limit: Maximum number of entries to claim
+    :param lease: Seconds until the entries are due again if not marked sent or failed
+    :return: List of (outbox_id, message_id, recipient) tuples
+    """
+    with transaction(immediate=True) as cursor:
+        cursor.execute(
+            "SELECT id, message_id, recipient FROM outbox "
+            "WHERE status = 'queued' AND next_attempt_at <= CURRENT_TIMESTAMP "
+            "ORDER BY id LIMIT ?",
+            (limit,)
+        )
+        entries = cursor.fetchall()
+
+        cursor.executemany(
+            "UPDATE outbox SET next_attempt_at = datetime('now', ?), updated_at = CURRENT_TIMESTAMP "
+            "WHERE id = ?",
+            [(f"+{int(lease)} seconds", entry[0]) for entry in entries]
+        )
+
+    logging.debug(f"Claimed {len(entries)} outbox entries.")
+
+    return entries
+
+def get_mail_message(message_id):
+    """Fetch a spooled message by ID. Returns (subject, content) or None."""
+    with transaction() as cursor:
+        cursor.execute("SELECT subject, content FROM mail_messages WHERE id = ?", (message_id,))
+        return cursor.fetchone()
+
+def mark_outbox_sent(outbox_ids):
+    """Mark outbox entries as sent."""
+    with transaction(immediate=True) as cursor:
+        cursor.executemany(
+            "UPDATE outbox SET status = 'sent', attempts = attempts + 1, last_error = NULL, "
+            "updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            [(outbox_id,) for outbox_id in outbox_ids]
+        )
+
+    logging.debug(f"Marked {len(outbox_ids)} outbox entries sent.")
+
+def mark_outbox_failed(failures, max_attempts, backoff):
+    """
+    Record failed delivery attempts. Entries are retried with exponential backoff
+    until they have been attempted max_attempts times, after which they are marked failed.
+
+    :param failures: List of (outbox_id, error message) tuples
+    :param max_attempts: Number of attempts before giving up
+    :param backoff: Delay in seconds before the first retry; doubled after every attempt
+    """
+    with transaction(immediate=True) as cursor:
+        cursor.executemany(
+            "UPDATE outbox SET attempts = attempts + 1, last_error = ?, "
+            "status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'queued' END, "
+            "next_attempt_at = datetime('now', '+' || (? * (1 << attempts)) || ' seconds'), "
+            "updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            [(error, max_attempts, int(backoff), outbox_id) for outbox_id, error in failures]
+        )
+
+    logging.debug(f"Marked {len(failures)} outbox delivery attempts failed.")
+
+def get_outbox_counts():
+    """Get the number of outbox entries per status."""
+    with transaction() as cursor:
+        cursor.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status")
+        counts = {"queued": 0, "failed": 0, "sent": 0}
+        counts.update(dict(cursor.fetchall()))
+
+    return counts
+
+def reset_outbox_backoff():
+    """Make all queued outbox entries due immediately, skipping any remaining retry delay."""
+    with transaction(immediate=True) as cursor:
+        cursor.execute(
+            "UPDATE outbox SET next_attempt_at = CURRENT_TIMESTAMP WHERE status = 'queued'"
+        )
+        reset = cursor.rowcount
+
+    logging.info(f"Made {reset} queued outbox entries due.")
+
+    return reset
+
+def requeue_failed_outbox():
+    """Queue failed outbox entries for another round of attempts."""
+    with transaction(immediate=True) as cursor:
+        cursor.execute(
+            "UPDATE outbox SET status = 'queued', attempts = 0, next_attempt_at = CURRENT_TIMESTAMP, "
+            "updated_at = CURRENT_TIMESTAMP WHERE status = 'failed'"
+        )
+        requeued = cursor.rowcount
+
+    logging.info(f"Requeued {requeued} failed outbox entries.")
+
+    return requeued
+
+def record_deliveries(subject, sent, failed, bounce_limit=None):
+    """
+    Log the outcome of sending a mail for each recipient.
+
+    :param subject: The subject of the mail
+    :param sent: The recipients the mail was accepted for
+    :param failed: Dict mapping the other recipients to (SMTP code, message) tuples,
+                   as returned by MailSender.send(). Codes 500 and up are logged as
+                   refused, other failures as failed.
+    :param bounce_limit: If given, refused recipients count as hard bounces, see record_bounces()
+    :return: List of the email addresses suspended now
+    """
+    rows = [(recipient, subject, "sent", None, None) for recipient in sent]
+    refused = []
+    for recipient, (code, error) in failed.items():
+        if isinstance(error, bytes):
+            error = error.decode("utf-8", errors="replace")
+        status = "refused" if code is not None and code >= 500 else "failed"
+        if status == "refused":
+            refused.append(recipient)
+        rows.append((recipient, subject, status, code, error))
+
+    with transaction(immediate=True) as cursor:
+        cursor.executemany(
+            "INSERT INTO deliveries (recipient, subject, status, smtp_code, error) VALUES (?, ?, ?, ?, ?)",
+            rows
+        )
+        suspended = _count_bounces(cursor, refused, bounce_limit) if bounce_limit and refused else []
+
+    logging.debug(f"Logged {len(rows)} deliveries of '{subject}'.")
+
+    return suspended
+
+def get_delivery_counts(days):
+    """Get the number of deliveries logged in the given number of days, per status."""
+    with transaction() as cursor:
+        cursor.execute(
+            "SELECT status, COUNT(*) FROM deliveries WHERE created_at >= datetime('now', ?) GROUP BY status",
+            (f"-{int(days)} days",)
+        )
+        counts = {"sent": 0, "failed": 0, "refused": 0, "bounced": 0}
+        counts.update(dict(cursor.fetchall()))
+
+    return counts
+
+def remove_deliveries_before(days):
+    """Remove delivery log entries older than the given number of days."""
+    with transaction(immediate=True) as cursor:
+        cursor.execute(
+            "DELETE FROM deliveries WHERE created_at < datetime('now', ?)",
+            (f"-{int(days)} days",)
+        )
+        removed = cursor.rowcount
+
+    logging.info(f"Removed {removed} delivery log entries older than {days} days.")
+
+    return removed
+
+def remove_sent_outbox_before(days):
+    """Remove outbox entries sent more than the given number of days ago, and messages left without entries."""
+    with transaction(immediate=True) as cursor:
+        cursor.execute(
+            "DELETE FROM outbox WHERE status = 'sent' AND updated_at < datetime('now', ?)",
+            (f"-{int(days)} days",)
+        )
+        removed = cursor.rowcount
+        cursor.execute(
+            "DELETE FROM mail_messages WHERE NOT EXISTS "
+            "(SELECT 1 FROM outbox WHERE outbox.message_id = mail_messages.id)"
+        )
+
+    logging.info(f"Removed {removed} sent outbox entries older than {days} days.")
+
+    return removed
@@ -2,31 +2,85 @@
 This module sets up an SMTP server to receive emails and process them.
 It handles subscription and unsubscription requests, and updates meal comments
 based on the content of the received emails.
+
+Bounce messages (delivery status notifications) are recognised and recorded as bounces
+of the failed recipients, who are suspended after [smtp] bounce_limit hard bounces.
+
+Messages are accepted as soon as they are queued; parsing, database updates and
+outgoing mail run on a bounded pool of worker threads so the SMTP server's event
+loop never blocks.
 """
 
 import asyncio
 import logging
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from email import message_from_bytes
+from email.utils import parseaddr
 
 from aiosmtpd.controller import Controller
 from bs4 import BeautifulSoup
 
 from lounasvahti import config
-from lounasvahti.database import update_meal_comment, get_meal_by_name, add_subscriber, remove_subscriber
-from lounasvahti.services.email_sender import send_weekly_mail, send_unsubscription_confirmation
+from lounasvahti.cache import get_cache_stats
+from lounasvahti.database import update_meal_comment, get_meal_by_name, add_subscriber, remove_subscriber, record_bounces
+from lounasvahti.services.email_sender import (
+    BOUNCE_LIMIT,
+    send_weekly_mail,
+    send_unsubscription_confirmation,
+)
+from lounasvahti.services.publisher import refresh_outputs
 
 # Configuration for the SMTP server
 BIND_ADDRESS = config["email_daemon"]["address"]
 BIND_PORT = config["email_daemon"]["port"]
+WORKERS = config.getint("email_daemon", "workers", fallback=4)
+MAX_PENDING = config.getint("email_daemon", "max_pending", fallback=100)
+
+# Local parts of the addresses bounce messages are sent from
+BOUNCE_SENDERS = ("mailer-daemon", "postmaster")
 
 class EmailHandler:
+    def __init__(self, workers=WORKERS, max_pending=MAX_PENDING):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="email-worker")
+        self.pending = threading.BoundedSemaphore(max_pending)
+
     async def handle_DATA(self, server, session, envelope):
         logging.info(f"Received email from: {envelope.mail_from}")
         logging.info(f"To: {envelope.rcpt_tos}")
 
+        # Defer the message instead of queueing without limit when the workers can't keep up
+        if not self.pending.acquire(blocking=False):
+            logging.warning(f"Too many pending messages, deferring email from {envelope.mail_from}")
+            return "451 4.3.2 Too many pending messages, try again later"
+
+        future = self.executor.submit(self.process_message, envelope.mail_from, envelope.content)
+        future.add_done_callback(self._message_processed)
+        return "250 OK"
+
+    def _message_processed(self, future):
+        """Releases the pending slot of a processed message and logs any failure."""
+        self.pending.release()
+        if future.exception():
+            logging.error("Failed to process email", exc_info=future.exception())
+        logging.debug(f"Cache stats: {get_cache_stats()}")
+
+    def shutdown(self):
+        """Waits for queued messages to be processed and stops the workers."""
+        self.executor.shutdown(wait=True)
+
+    def process_message(self, mail_from, content):
+        """
+        Processes a received message on a worker thread: handles subscription and
+        unsubscription requests and meal comments.
+        """
         # Decode the email message
-        msg = message_from_bytes(envelope.content)
+        msg = message_from_bytes(content)
+
+        if self.is_bounce(mail_from, msg):
+            self.handle_bounce(msg)
+            return
 
         # Extract plain text content, fallback to HTML if necessary
         text = self.extract_text(msg)
@@ -36,28 +90,73 @@ class EmailHandler:
         first_word = self.get_first_word(text)
         if first_word:
             if first_word.lower() == "tilaa":
-                logging.info(f"Subscription request from {envelope.mail_from}")
-                self.handle_subscription(envelope.mail_from)
-                return "250 OK"
+                logging.info(f"Subscription request from {mail_from}")
+                self.handle_subscription(mail_from)
+                return
             elif first_word.lower() == "lopeta":
-                logging.info(f"Unsubscription request from {envelope.mail_from}")
-                self.handle_unsubscription(envelope.mail_from)
-                return "250 OK"
+                logging.info(f"Unsubscription request from {mail_from}")
+                self.handle_unsubscription(mail_from)
+                return
 
         # Process the extracted text to get meal_name and new_comment
         meal_name, new_comment = self.parse_comment(text)
         if meal_name and new_comment:
             logging.info(f"Meal Name: {meal_name}")
             logging.info(f"New Comment: {new_comment}")
-            meal_id, _ = get_meal_by_name(meal_name)
-            if meal_id:
+            meal = get_meal_by_name(meal_name)
+            if meal:
+                meal_id, _ = meal
                 update_meal_comment(meal_id, new_comment)
+                refresh_outputs()
             else:
                 logging.warning("Meal not found in database.")
         else:
             logging.warning("Could not extract a valid comment.")
 
-        return "250 OK"
+    def is_bounce(self, mail_from, msg):
+        """
+        Checks whether a message is a bounce: a delivery status report, or a message
+        with a null envelope sender or from a mailer daemon.
+        """
+        if msg.get_content_type() == "multipart/report" and msg.get_param("report-type") == "delivery-status":
+            return True
+        if mail_from in ("", "<>"):
+            return True
+        sender = parseaddr(msg.get("From", ""))[1] or mail_from or ""
+        return sender.split("@")[0].lower() in BOUNCE_SENDERS
+
+    def get_failed_recipients(self, msg):
+        """
+        Extracts the permanently failed recipients from a delivery status report.
+
+        :return: List of (email, smtp_code, diagnostic) tuples, smtp_code being None if not given
+        """
+        failed = []
+        for part in msg.walk():
+            if part.get_content_type() != "message/delivery-status":
+                continue
+            # The first block describes the report, the rest one recipient each
+            for block in part.get_payload()[1:]:
+                recipient = block.get("Original-Recipient") or block.get("Final-Recipient") or ""
+                email = recipient.split(";", 1)[-1].strip()
+                action = (block.get("Action") or "").strip().lower()
+                status = (block.get("Status") or "").strip()
+                if not email or action != "failed" or not status.startswith("5"):
+                    logging.info(f"Ignoring non-permanent delivery status for {email}: {action} {status}")
+                    continue
+                diagnostic = (block.get("Diagnostic-Code") or status).strip()
+                code = re.search(r"\b(5\d\d)\b", diagnostic)
+                failed.append((email, int(code.group(1)) if code else None, diagnostic))
+        return failed
+
+    def handle_bounce(self, msg):
+        """Handles bounce messages: records hard bounces of the failed recipients."""
+        failed = self.get_failed_recipients(msg)
+        if not failed:
+            logging.warning(f"Bounce without permanent failures ignored: {msg.get('Subject')}")
+            return
+        logging.info(f"Bounce for {', '.join(email for email, _, _ in failed)}")
+        record_bounces(failed, BOUNCE_LIMIT)
 
     def extract_text(self, msg):
         """
@@ -141,7 +240,8 @@ def receive_email_blocking():
     """
     Runs the SMTP server in a blocking manner for debugging from the terminal.
     """
-    controller = Controller(EmailHandler(), hostname=BIND_ADDRESS, port=BIND_PORT)
+    handler = EmailHandler()
+    controller = Controller(handler, hostname=BIND_ADDRESS, port=BIND_PORT)
     controller.start()
     logging.info(f"SMTP server running on {BIND_ADDRESS}:{BIND_PORT}... Press Ctrl+C to stop.")
 
@@ -153,6 +253,7 @@ def receive_email_blocking():
         logging.info("Shutting down SMTP server...")
     finally:
         controller.stop()
+        handler.shutdown()
         loop.close()
 
 if __name__ == "__main__":
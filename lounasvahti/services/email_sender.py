@@ -6,20 +6,44 @@ to specified recipients. Additionally, it handles unsubscription confirmations.
 
 import logging
 import smtplib
+import threading
+import time
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from email.message import EmailMessage
 
+from markupsafe import Markup
+
 from lounasvahti import config
-from lounasvahti.database import get_menu
+from lounasvahti.database import (
+    enqueue_mail,
+    get_mail_artifact,
+    get_menu,
+    get_menu_version,
+    get_menus_between,
+    get_pending_menu_changes,
+    mark_menu_changes_notified,
+    record_deliveries,
+    remove_mail_artifacts_before_date,
+    save_mail_artifact,
+)
 from lounasvahti.logging_config import log_html
+from lounasvahti.templating import get_template, render_template
 from lounasvahti.utils import (
     get_next_week_workdays,
     get_this_week_workdays,
     get_today,
+    get_tomorrow,
+    get_week_workdays,
     get_weekday_in_finnish,
-    load_template,
 )
 
+BATCH_SIZE = config.getint("smtp", "batch_size", fallback=50)
+DELIVERY_MODE = config.get("smtp", "delivery", fallback="bcc")  # "bcc" or "individual"
+WORKERS = config.getint("smtp", "workers", fallback=4)
+RATE = config.getfloat("smtp", "rate", fallback=10)  # Messages per second, 0 for no limit
+BOUNCE_LIMIT = config.getint("smtp", "bounce_limit", fallback=3)  # Hard bounces before suspending a subscriber
+
 def generate_mailto_link(meal_name, comment):
     """
     Generates a properly encoded mailto link.
@@ -45,134 +69,476 @@ def generate_unsubscribe_link():
     logging.debug("Generating unsubscribe link")
     return f"mailto:{config['smtp']['reply_to']}?subject=lopeta&body=lopeta"
 
-def compose_weekly_mail(this_week=False):
+def compose_weekly_mail(this_week=False, monday=None):
     """
     Composes the weekly email content.
     
     :param this_week: Boolean indicating if the email is for this week or next week.
+    :param monday: Monday of the week to compose, in ISO format. Defaults to this or next week.
     :return: Formatted email content.
     """
     logging.info("Composing weekly mail, this_week=%s", this_week)
-    if this_week:
+    if monday:
+        workdays = get_week_workdays(monday)
+    elif this_week:
         workdays = get_this_week_workdays()
-        title = "Tämän viikon lounaslista"
     else:
         workdays = get_next_week_workdays()
-        title = "Ensi viikon lounaslista"
-    content = "\n".join([compose_menu_for_day(d) for d in workdays])
-    email_template = load_template("email_template.html")
+    title = "Tämän viikon lounaslista" if this_week else "Ensi viikon lounaslista"
+    menus = get_menus_between(workdays[0], workdays[-1])
+    content = Markup("\n").join([compose_menu_for_day(d, menus.get(d, [])) for d in workdays])
     unsubscribe_link = generate_unsubscribe_link()
         
-    return email_template.format(title=title, content=content, unsubscribe_link=unsubscribe_link)
+    return render_template("email_template.html", title=title, content=content, unsubscribe_link=unsubscribe_link)
 
-def compose_daily_mail():
+def compose_daily_mail(date=None):
     """
     Composes the daily email content.
     
+    :param date: The date to compose the mail for, in ISO format. Defaults to today.
     :return: Formatted email content.
     """
-    logging.info("Composing daily mail")
-    content = compose_menu_for_day(get_today())
-    email_template = load_template("email_template.html")
+    date = date or get_today()
+    logging.info("Composing daily mail for %s", date)
+    # Read past the menu cache, as the mail is stored under the current menu version
+    menu_items = get_menus_between(date, date).get(date, [])
+    content = compose_menu_for_day(date, menu_items)
     unsubscribe_link = generate_unsubscribe_link()
     
-    return email_template.format(title=f"Päivän lounas {get_today()}", content=content, unsubscribe_link=unsubscribe_link)
+    return render_template("email_template.html", title=f"Päivän lounas {date}", content=content, unsubscribe_link=unsubscribe_link)
+
+def compose_menu_update_mail(dates):
+    """
+    Composes the email telling that the menus of some days have changed.
+    
+    :param dates: The ISO dates whose menus have changed.
+    :return: Formatted email content.
+    """
+    logging.info("Composing menu update mail for %s", ", ".join(dates))
+    menus = get_menus_between(dates[0], dates[-1])
+    content = Markup("\n").join([compose_menu_for_day(d, menus.get(d, [])) for d in dates])
+    unsubscribe_link = generate_unsubscribe_link()
+
+    return render_template("email_template.html", title="Lounaslista on päivittynyt", content=content, unsubscribe_link=unsubscribe_link)
+
+# Kinds of pre-rendered mail. Daily mails are stored by date, weekly ones by the week's Monday.
+MAIL_KINDS = ("daily", "this_week", "next_week")
+
+def get_rendered_mail(kind, date, store=True):
+    """
+    Gets a pre-rendered mail, rendering and storing it first if it is missing or stale.
+    Mails are stored in the database as artifacts with the version of the menus they
+    show, so they are re-rendered only when those menus change.
+    
+    :param kind: One of MAIL_KINDS.
+    :param date: The date of a daily mail, or the Monday of a weekly one, in ISO format.
+    :param store: Whether to store a newly rendered mail. Only store the mails that
+                  prerender_mails() manages, as no others are ever removed.
+    :return: Formatted email content.
+    """
+    if kind == "daily":
+        start = end = date
+    else:
+        workdays = get_week_workdays(date)
+        start, end = workdays[0], workdays[-1]
+
+    # Read the version before rendering, so a change made meanwhile makes the artifact stale
+    version = get_menu_version(start, end)
+    artifact = get_mail_artifact(kind, date)
+    if artifact and artifact[1] == version:
+        logging.debug("Using pre-rendered %s mail for %s", kind, date)
+        return artifact[0]
+
+    if kind == "daily":
+        content = compose_daily_mail(date)
+    else:
+        content = compose_weekly_mail(this_week=kind == "this_week", monday=date)
+    if store:
+        save_mail_artifact(kind, date, content, version)
+    return content
+
+def get_prerendered_mails():
+    """Gets the (kind, date) pairs of the mails prerender_mails() keeps rendered."""
+    return [
+        ("daily", get_today()),
+        ("daily", get_tomorrow()),
+        ("this_week", get_this_week_workdays()[0]),
+        ("next_week", get_next_week_workdays()[0]),
+    ]
+
+def prerender_mails():
+    """
+    Renders today's and tomorrow's daily mails and this and next week's weekly mails,
+    where stale. Call after the menus or comments change, so sending needs no rendering.
+    """
+    logging.info("Pre-rendering mails")
+    for kind, date in get_prerendered_mails():
+        get_rendered_mail(kind, date)
+    remove_mail_artifacts_before_date(get_this_week_workdays()[0])
 
-def compose_menu_for_day(date):
+def compose_menu_for_day(date, menu_items=None, meal_template_name="meal_template.html"):
     """
     Composes the menu for a specific day.
     
     :param date: The date for which to compose the menu.
-    :return: Formatted menu content.
+    :param menu_items: The day's (meal_id, name, comment) rows, if already fetched.
+    :param meal_template_name: The template of each meal, the one with the comment links by default.
+    :return: Formatted menu content, marked safe for inclusion in other templates.
     """
     logging.debug("Composing menu for day: %s", date)
     day_name = get_weekday_in_finnish(date)
-    menu_items = get_menu(date)
+    if menu_items is None:
+        menu_items = get_menu(date)
 
-    meal_template = load_template("meal_template.html")
+    meal_template = get_template(meal_template_name)
+    server_url = config["server"]["url"]
     content = ""
     for (meal_id, name, comment) in menu_items:
         comment = comment if comment else ""
         mailto_link = generate_mailto_link(name, comment)
-        server_url = config["server"]["url"]
-        content += meal_template.format(meal_id=meal_id, name=name, comment=comment, mailto_link=mailto_link, server_url=server_url)
+        content += meal_template.render(meal_id=meal_id, name=name, comment=comment, mailto_link=mailto_link, server_url=server_url)
+    
+    return Markup(render_template("day_template.html", name=day_name, date=date, content=Markup(content)))
+
+def compose_message(subject, content, to="undisclosed-recipients:;"):
+    """
+    Builds an HTML email message.
     
-    day_template = load_template("day_template.html")
+    :param subject: The subject of the email.
+    :param content: The HTML content of the email.
+    :param to: The visible To header. Actual recipients are given in the envelope.
+    :return: EmailMessage
+    """
+    msg = EmailMessage()
+    msg["Subject"] = subject
+    msg["From"] = config["smtp"]["email"]
+    msg["Reply-To"] = config["smtp"]["reply_to"]
+    msg["To"] = to
+    msg.set_content(content, subtype="html")
+    return msg
+
+class MailSender:
+    """
+    Sends mail over one authenticated SMTP connection that stays open across messages
+    and is re-established if the server drops it. Use as a context manager.
+
+    In "bcc" delivery mode, recipients only appear in the envelope and are sent in
+    batches of batch_size. In "individual" mode, each recipient gets their own copy
+    with their address in the To header.
+    """
+
+    def __init__(self, batch_size=None, delivery=None, rate_limiter=None):
+        self.batch_size = batch_size or BATCH_SIZE
+        self.delivery = delivery or DELIVERY_MODE
+        self.rate_limiter = rate_limiter
+        self.smtp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def connect(self):
+        """Opens and authenticates the SMTP connection."""
+        logging.info("Connecting to SMTP server %s", config["smtp"]["server"])
+        smtp = smtplib.SMTP_SSL(config["smtp"]["server"], config["smtp"]["port"])
+        smtp.login(config["smtp"]["email"], config["smtp"]["password"])
+        self.smtp = smtp
+
+    def close(self):
+        """Closes the SMTP connection, if open."""
+        if self.smtp is None:
+            return
+        try:
+            self.smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            pass  # The connection is being discarded anyway
+        self.smtp = None
+
+    def _send_message(self, msg, recipients):
+        """Sends one message, reconnecting once if the connection has been dropped."""
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+        if self.smtp is None:
+            self.connect()
+        try:
+            return self.smtp.send_message(msg, config["smtp"]["email"], recipients)
+        except (smtplib.SMTPServerDisconnected, ConnectionError) as e:
+            logging.warning("SMTP connection lost (%s), reconnecting", e)
+            self.smtp = None
+            self.connect()
+            return self.smtp.send_message(msg, config["smtp"]["email"], recipients)
+
+    def send(self, subject, content, recipients):
+        """
+        Sends an email to the given recipients.
+        
+        :param subject: The subject of the email.
+        :param content: The HTML content of the email.
+        :param recipients: A recipient email address or a list of them.
+        :return: Dict mapping each recipient that could not be delivered to
+                 to an (SMTP code, message) tuple. Empty if all succeeded. The code
+                 is None if the whole batch failed rather than the recipient.
+        """
+        if isinstance(recipients, str):
+            recipients = [recipients]
+
+        if self.delivery == "individual":
+            batches = [[recipient] for recipient in recipients]
+        else:
+            batches = [recipients[i:i + self.batch_size] for i in range(0, len(recipients), self.batch_size)]
+
+        msg = compose_message(subject, content)
+        failed = {}
+        for i, batch in enumerate(batches):
+            if self.delivery == "individual":
+                del msg["To"]
+                msg["To"] = batch[0]
+            try:
+                failed.update(self._send_message(msg, batch))
+            except smtplib.SMTPRecipientsRefused as e:
+                failed.update(e.recipients)
+            except (smtplib.SMTPException, OSError) as e:
+                logging.error("Failed to send mail to %d recipients: %s", len(batch), e)
+                # Not the recipients' fault, so no code that would count as their bounce
+                error = (None, str(e))
+                if self.smtp is None:
+                    # No connection could be made, so the remaining batches would fail too
+                    failed.update({r: error for b in batches[i:] for r in b})
+                    break
+                failed.update({r: error for r in batch})
+
+        return failed
+
+class NullSender(MailSender):
+    """A MailSender that only logs the messages it would send. Used for dry runs."""
+
+    def connect(self):
+        logging.info("Dry run, not connecting to SMTP server")
+        self.smtp = True
+
+    def close(self):
+        self.smtp = None
+
+    def _send_message(self, msg, recipients):
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+        if self.smtp is None:
+            self.connect()
+        logging.info("Dry run, not sending '%s' to %s", msg["Subject"], recipients)
+        return {}
+
+class RateLimiter:
+    """
+    Thread-safe token bucket allowing on average `rate` messages per second,
+    with bursts of up to `burst` messages.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a message may be sent."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def dispatch(subject, content, recipients, workers=None, rate=None, dry_run=False):
+    """
+    Sends an email to many recipients over several concurrent SMTP connections.
+    Recipients are split into batches of batch_size, and the batches are partitioned
+    between the workers. All workers share one messages-per-second limit.
+    The outcome for each recipient is logged in the deliveries table, and recipients
+    the server refuses permanently count as hard bounces (see record_deliveries()).
     
-    return day_template.format(name=day_name, date=date, content=content)
+    :param subject: The subject of the email.
+    :param content: The HTML content of the email.
+    :param recipients: A list of recipient email addresses.
+    :param workers: Number of concurrent connections, [smtp] workers by default.
+    :param rate: Messages per second over all connections, [smtp] rate by default.
+    :param dry_run: Use NullSender instead of actually sending.
+    :return: Dict with the number of recipients "sent", the "failed" recipients
+             (see MailSender.send()) and per-batch (sent, failed) counts in "batches".
+    """
+    if isinstance(recipients, str):
+        recipients = [recipients]
+    workers = workers or WORKERS
+    rate_limiter = RateLimiter(RATE if rate is None else rate)
+    sender_class = NullSender if dry_run else MailSender
+
+    batches = [recipients[i:i + BATCH_SIZE] for i in range(0, len(recipients), BATCH_SIZE)]
+    workers = max(1, min(workers, len(batches)))
+    partitions = [list(range(len(batches)))[i::workers] for i in range(workers)]
+    logging.info("Dispatching '%s' to %d recipients in %d batches over %d connections",
+                 subject, len(recipients), len(batches), workers)
+
+    results = [None] * len(batches)
+
+    def run_partition(batch_numbers):
+        with sender_class(rate_limiter=rate_limiter) as sender:
+            for n in batch_numbers:
+                failed = sender.send(subject, content, batches[n])
+                results[n] = failed
+                logging.info("Batch %d/%d: %d sent, %d failed",
+                             n + 1, len(batches), len(batches[n]) - len(failed), len(failed))
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mail-worker") as executor:
+        for future in [executor.submit(run_partition, p) for p in partitions]:
+            future.result()
 
-def send_mail(subject, content, recipients):
+    failed = {}
+    for failed_in_batch in results:
+        failed.update(failed_in_batch)
+    if not dry_run:
+        record_deliveries(subject, [r for r in recipients if r not in failed], failed, BOUNCE_LIMIT)
+    report = {
+        "sent": len(recipients) - len(failed),
+        "failed": failed,
+        "batches": [(len(batch) - len(f), len(f)) for batch, f in zip(batches, results)],
+    }
+    if failed:
+        logging.error("Failed to send '%s' to %d of %d recipients", subject, len(failed), len(recipients))
+    else:
+        logging.info("'%s' sent successfully to %d recipients", subject, len(recipients))
+    return report
+
+def send_mail(subject, content, recipients, sender=None):
     """
-    Sends an email with the given subject and content to the specified recipients.
+    Sends an email with the given subject and content to the specified recipients,
+    logging the outcome for each recipient like dispatch().
     
     :param subject: The subject of the email.
     :param content: The content of the email.
     :param recipients: A list of recipient email addresses.
+    :param sender: An open MailSender to reuse. A new connection is made if not given.
+    :return: Dict of recipients that could not be delivered to, see MailSender.send().
     """
     logging.info("Sending mail with subject: %s", subject)
     if type(recipients) is str:
         recipients = [recipients]
-    
-    msg = EmailMessage()
-    msg["Subject"] = subject
-    msg["From"] = config["smtp"]["email"]
-    msg["Reply-To"] = config["smtp"]["reply_to"]
-    msg["To"] = ", ".join(recipients)
-    msg.set_content(content, subtype="html")
-    try:
-        with smtplib.SMTP_SSL(config["smtp"]["server"], config["smtp"]["port"]) as smtp_server:
-            smtp_server.login(config["smtp"]["email"], config["smtp"]["password"])
-            smtp_server.send_message(msg, config["smtp"]["email"], recipients)
-        logging.info("Mail sent successfully to %s", recipients)
-    except Exception as e:
-        logging.error("Failed to send mail: %s", e)
 
-def send_weekly_mail(recipients, this_week=False, dry_run=False):
+    if sender is None:
+        with MailSender() as sender:
+            return send_mail(subject, content, recipients, sender)
+
+    failed = sender.send(subject, content, recipients)
+    if not isinstance(sender, NullSender):
+        record_deliveries(subject, [r for r in recipients if r not in failed], failed, BOUNCE_LIMIT)
+    if failed:
+        logging.error("Failed to send mail to %d of %d recipients: %s", len(failed), len(recipients), failed)
+    else:
+        logging.info("Mail sent successfully to %d recipients", len(recipients))
+    return failed
+
+def send_weekly_mail(recipients, this_week=False, dry_run=False, sender=None):
     """
     Sends the weekly email to the specified recipients.
     
     :param recipients: A list of recipient email addresses.
     :param this_week: Boolean indicating if the email is for this week or next week.
     :param dry_run: Boolean indicating if the email should actually be sent or just logged.
+    :param sender: An open MailSender to send with right away. By default the mail
+                   is queued in the outbound mail spool.
     """
     logging.info("Sending weekly mail, this_week=%s", this_week)
-    content = compose_weekly_mail(this_week)
+    if this_week:
+        content = get_rendered_mail("this_week", get_this_week_workdays()[0])
+    else:
+        content = get_rendered_mail("next_week", get_next_week_workdays()[0])
     subject = "Tämän viikon lounaslista" if this_week else "Ensi viikon lounaslista"    
     if dry_run:
         logging.info("Dry run enabled, not sending weekly mail")
-        logging.info("Recipients: %s", recipients)
         logging.info("Subject: %s", subject)
         log_html("weekly.html", content)
         logging.info("Content logged to weekly.html")
-        return
-    send_mail(subject, content, recipients)
+        return dispatch(subject, content, recipients, dry_run=True)
+    if sender is not None:
+        return send_mail(subject, content, recipients, sender)
+    return enqueue_mail(subject, content, recipients)
 
-def send_daily_mail(recipients, dry_run=False):
+def send_daily_mail(recipients, dry_run=False, sender=None):
     """
     Sends the daily email to the specified recipients.
     
     :param recipients: A list of recipient email addresses.
     :param dry_run: Boolean indicating if the email should actually be sent or just logged.
+    :param sender: An open MailSender to send with right away. By default the mail
+                   is queued in the outbound mail spool.
     """
     logging.info("Sending daily mail")
-    content = compose_daily_mail()
+    content = get_rendered_mail("daily", get_today())
     subject = "Päivän lounas"
     if dry_run:
         logging.info("Dry run enabled, not sending daily mail")
-        logging.info("Recipients: %s", recipients)
         logging.info("Subject: %s", subject)
         log_html("daily.html", content)
         logging.info("Content logged to daily.html")
-        return
-    send_mail(subject, content, recipients)
+        return dispatch(subject, content, recipients, dry_run=True)
+    if sender is not None:
+        return send_mail(subject, content, recipients, sender)
+    return enqueue_mail(subject, content, recipients)
+
+def send_menu_update_mail(recipients, dry_run=False, sender=None):
+    """
+    Sends an email showing the days whose menus have changed since they were last
+    notified or sent. Changes to past days are dropped without notifying.
+    
+    :param recipients: A list of recipient email addresses.
+    :param dry_run: Boolean indicating if the email should actually be sent or just logged.
+    :param sender: An open MailSender to send with right away. By default the mail
+                   is queued in the outbound mail spool.
+    :return: None if no menus have changed, otherwise as send_mail(), enqueue_mail() or dispatch().
+    """
+    today = get_today()
+    changes = get_pending_menu_changes(from_date=today)
+    if not dry_run:
+        mark_menu_changes_notified(before_date=today)
+    if not changes:
+        logging.info("No menu changes to notify")
+        return None
+
+    dates = sorted({date for _, date, _, _ in changes})
+    logging.info("Sending menu update mail for %d days", len(dates))
+    content = compose_menu_update_mail(dates)
+    subject = "Lounaslista on päivittynyt"
+    if dry_run:
+        logging.info("Dry run enabled, not sending menu update mail")
+        logging.info("Subject: %s", subject)
+        log_html("menu_update.html", content)
+        logging.info("Content logged to menu_update.html")
+        return dispatch(subject, content, recipients, dry_run=True)
+    if sender is not None:
+        result = send_mail(subject, content, recipients, sender)
+    else:
+        result = enqueue_mail(subject, content, recipients)
+    mark_menu_changes_notified([change_id for change_id, _, _, _ in changes])
+    return result
 
-def send_unsubscription_confirmation(email):
+def send_unsubscription_confirmation(email, sender=None):
     """
     Sends an unsubscription confirmation email to the specified address.
     
     :param email: The email address to send the confirmation to.
+    :param sender: An open MailSender to send with right away. By default the mail
+                   is queued in the outbound mail spool.
     """
     logging.info("Sending unsubscription confirmation to %s", email)
     subject = "Vahvistus tilauksen lopetuksesta"
     content = "Tilaus on lopetettu onnistuneesti. Voit tilata uudelleen lähettämällä sähköpostin, jonka sisältönä on 'tilaa'."
-    send_mail(subject, content, email)
+    if sender is not None:
+        return send_mail(subject, content, email, sender)
+    return enqueue_mail(subject, content, email)
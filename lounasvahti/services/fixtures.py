@@ -0,0 +1,155 @@
+"""
+This module provides record and replay transports for the scraper, so that it can be run
+and measured without network access.
+
+In record mode, every request the scraper makes goes to the live site as usual and the
+exchange is also written to a fixture directory, one JSON file per request. In replay
+mode, the requests are answered from a fixture directory and nothing is sent.
+Fixtures are matched by method, URL and, for postbacks, the __EVENTTARGET that was
+posted, as the rest of the form (the view state) differs from session to session.
+
+The mode is enabled with enable(), or with the fixtures and fixture_dir options of
+[scraper] in config.ini. Scrapers created afterwards mount the transport on their session.
+They also leave the saved sessions and circuit breakers under [database] path alone:
+every scrape starts a new session, so that a recording always begins with the first
+page, and missing fixtures cannot open the breaker of the live site.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import parse_qs
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from lounasvahti import config
+
+MODES = ("record", "replay")
+
+# Response headers kept in fixtures
+KEPT_HEADERS = ("Content-Type", "Location")
+
+_mode = config.get("scraper", "fixtures", fallback="") or None
+_path = config.get("scraper", "fixture_dir", fallback="") or os.path.join(config.get("database", "path", fallback="."), "fixtures")
+
+# Serializes numbering of recorded fixtures between threads
+_record_lock = threading.Lock()
+
+def enable(mode, path):
+    """
+    Record to or replay from the fixture directory path in scrapers created from now on.
+
+    :param mode: "record", "replay" or None to use the network normally
+    """
+    global _mode, _path
+    if mode is not None and mode not in MODES:
+        raise ValueError(f"Unknown fixture mode '{mode}', expected one of {MODES}")
+    _mode, _path = mode, path
+    logging.info(f"Scraper fixture mode: {mode or 'off'}, directory {path}")
+
+def get_mode():
+    """Get the enabled fixture mode, "record" or "replay", or None if fixtures are not enabled."""
+    return _mode
+
+def mount(session):
+    """Mount the enabled transport on a requests session. Does nothing if fixtures are not enabled."""
+    if _mode is None:
+        return
+    adapter = RecordingAdapter(_path) if _mode == "record" else ReplayAdapter(_path)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+def fixture_key(method, url, body=None):
+    """The key a request is matched by: method, URL and the posted __EVENTTARGET, if any."""
+    if isinstance(body, bytes):
+        body = body.decode("utf-8")
+    event_target = parse_qs(body or "").get("__EVENTTARGET", [""])[0]
+    return f"{method} {url} {event_target}".rstrip()
+
+def load_fixtures(path):
+    """
+    Load the fixtures of a directory in the order they were recorded.
+
+    :return: List of fixture dicts, see RecordingAdapter
+    """
+    fixtures = []
+    for name in sorted(os.listdir(path)):
+        if name.endswith(".json"):
+            with open(os.path.join(path, name), "r", encoding="utf-8") as f:
+                fixtures.append(json.load(f))
+    return fixtures
+
+class RecordingAdapter(HTTPAdapter):
+    """
+    Transport adapter that sends requests normally and writes each exchange to a
+    numbered JSON file with the request key, method, URL and body, the response status,
+    URL, kept headers and text, and the time the exchange took.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def send(self, request, **kwargs):
+        start = time.monotonic()
+        response = super().send(request, **kwargs)
+        fixture = {
+            "key": fixture_key(request.method, request.url, request.body),
+            "method": request.method,
+            "url": request.url,
+            "body": request.body.decode("utf-8") if isinstance(request.body, bytes) else request.body,
+            "status": response.status_code,
+            "response_url": response.url,
+            "headers": {name: response.headers[name] for name in KEPT_HEADERS if name in response.headers},
+            "text": response.text,
+            "elapsed": time.monotonic() - start,
+        }
+        with _record_lock:
+            number = sum(1 for name in os.listdir(self.path) if name.endswith(".json"))
+            file_name = os.path.join(self.path, f"{number:04d}-{request.method.lower()}.json")
+            with open(file_name, "w", encoding="utf-8") as f:
+                json.dump(fixture, f, ensure_ascii=False, indent=1)
+        logging.info(f"Recorded {fixture['key']} to {file_name}")
+        return response
+
+class ReplayAdapter(BaseAdapter):
+    """
+    Transport adapter that answers requests from recorded fixtures. Fixtures with the same
+    key are served in the order they were recorded, the last one repeating once they run out.
+    A request with no fixture raises requests.ConnectionError, as if the site were down.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.fixtures = defaultdict(list)
+        for fixture in load_fixtures(path):
+            self.fixtures[fixture["key"]].append(fixture)
+        logging.info(f"Loaded {sum(map(len, self.fixtures.values()))} fixtures from {path}")
+
+    def send(self, request, **kwargs):
+        key = fixture_key(request.method, request.url, request.body)
+        with self.lock:
+            queue = self.fixtures.get(key)
+            if not queue:
+                raise requests.ConnectionError(f"No fixture for {key}", request=request)
+            fixture = queue.pop(0) if len(queue) > 1 else queue[0]
+
+        response = requests.Response()
+        response.status_code = fixture["status"]
+        response.url = fixture["response_url"]
+        response.headers = CaseInsensitiveDict(fixture["headers"])
+        response.encoding = "utf-8"
+        response._content = fixture["text"].encode("utf-8")
+        response.request = request
+        response.reason = "Replayed"
+        return response
+
+    def close(self):
+        pass
@@ -0,0 +1,80 @@
+"""
+This module drains the outbound mail spool. Composed messages are queued in the
+database with enqueue_mail(); the drain sends them with dispatch() and retries failed
+deliveries with exponential backoff until the attempt limit is reached. Recipients the
+server refuses permanently (5xx) are not retried.
+"""
+
+import logging
+import time
+
+from lounasvahti import config
+from lounasvahti.database import (
+    claim_outbox,
+    get_mail_message,
+    mark_outbox_failed,
+    mark_outbox_sent,
+    reset_outbox_backoff,
+)
+from lounasvahti.services.email_sender import dispatch
+
+MAX_ATTEMPTS = config.getint("outbox", "max_attempts", fallback=5)
+BACKOFF = config.getint("outbox", "backoff", fallback=60)  # Seconds before the first retry
+POLL_INTERVAL = config.getint("outbox", "poll_interval", fallback=10)
+CLAIM_SIZE = config.getint("outbox", "claim_size", fallback=1000)
+LEASE = config.getint("outbox", "lease", fallback=600)
+
+def drain(flush=False):
+    """
+    Sends all spooled mail that is due.
+    
+    :param flush: Send queued mail that is waiting for a retry right away.
+    :return: Tuple with the number of deliveries sent and failed.
+    """
+    if flush:
+        reset_outbox_backoff()
+
+    sent = failed = 0
+    while True:
+        entries = claim_outbox(CLAIM_SIZE, LEASE)
+        if not entries:
+            break
+
+        # Group the recipients by message so that each message is dispatched once
+        messages = {}
+        for outbox_id, message_id, recipient in entries:
+            messages.setdefault(message_id, {})[recipient] = outbox_id
+
+        for message_id, outbox_ids in messages.items():
+            subject, content = get_mail_message(message_id)
+            report = dispatch(subject, content, list(outbox_ids))
+            mark_outbox_sent([
+                outbox_id for recipient, outbox_id in outbox_ids.items()
+                if recipient not in report["failed"]
+            ])
+            permanent, transient = [], []
+            for recipient, error in report["failed"].items():
+                code = error[0]
+                failures = permanent if code is not None and code >= 500 else transient
+                failures.append((outbox_ids[recipient], str(error)))
+            mark_outbox_failed(transient, MAX_ATTEMPTS, BACKOFF)
+            mark_outbox_failed(permanent, 1, BACKOFF)
+            sent += report["sent"]
+            failed += len(report["failed"])
+
+    if sent or failed:
+        logging.info("Outbox drained: %d sent, %d failed", sent, failed)
+    return sent, failed
+
+def run_worker():
+    """Drains the outbox continuously, polling for new mail every POLL_INTERVAL seconds."""
+    logging.info("Outbox worker started, polling every %d seconds", POLL_INTERVAL)
+    while True:
+        try:
+            drain()
+        except Exception:
+            logging.exception("Failed to drain outbox")
+        time.sleep(POLL_INTERVAL)
+
+if __name__ == "__main__":
+    run_worker()
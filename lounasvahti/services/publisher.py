@@ -0,0 +1,235 @@
+"""
+This module publishes the menus as static files for a web server such as nginx to serve,
+so that read-only traffic never reaches the Flask process: an HTML page per week for
+lobby screens, and an iCalendar feed with one all-day event per day listing the meals
+and their comments.
+
+The files are written to [publish] dir, which must be set for anything to be published:
+- week-YYYY-MM-DD.html and week-YYYY-MM-DD.ics for each week, named by its Monday
+- index.html, a copy of this week's page
+- menu.ics, the feed of all published weeks
+
+Publishing is incremental. Each week's files are regenerated only when the week's menu
+version (see get_menu_version()) differs from the one they were generated from, which
+happens when its daily_menus or meals rows change. Call publish() after storing menus
+or updating comments. Files are replaced atomically, so a half-written file is never served.
+"""
+
+import fcntl
+import json
+import logging
+import os
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from urllib.parse import urlsplit
+
+from markupsafe import Markup
+
+from lounasvahti import config
+from lounasvahti.database import get_menu_version, get_menus_between
+from lounasvahti.services.email_sender import compose_menu_for_day, prerender_mails
+from lounasvahti.templating import render_template
+from lounasvahti.utils import get_this_week_workdays, get_week_workdays, write_file_atomically
+
+PUBLISH_DIR = config.get("publish", "dir", fallback="")  # Empty to disable publishing
+WEEKS = max(1, config.getint("publish", "weeks", fallback=2))  # Weeks published from this week on, at least one
+REFRESH = config.getint("publish", "refresh", fallback=900)  # Seconds between page reloads on screens
+
+# {"weeks": {week Monday: menu version and position its files were generated from},
+#  "index": Monday of the week in index.html}
+MANIFEST = "manifest.json"
+
+# Lines of an iCalendar file before its events
+ICS_HEADER = [
+    "BEGIN:VCALENDAR",
+    "VERSION:2.0",
+    "PRODID:-//Lounasvahti//Lounaslista//FI",
+    "CALSCALE:GREGORIAN",
+    "X-WR-CALNAME:Lounaslista",
+]
+
+# Domain of the calendar event UIDs
+UID_DOMAIN = urlsplit(config.get("server", "url", fallback="")).hostname or "lounasvahti"
+
+@contextmanager
+def _locked(directory):
+    """Hold an exclusive lock on the publish directory, so that processes publish one at a time."""
+    with open(os.path.join(directory, ".lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _load_manifest(directory):
+    """Load the versions the published weeks were generated from. Call with the lock held."""
+    try:
+        with open(os.path.join(directory, MANIFEST), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"weeks": {}, "index": None}
+
+def get_published_weeks():
+    """Get the Mondays of the weeks to publish, in ISO format, starting from this week."""
+    this_monday = date.fromisoformat(get_this_week_workdays()[0])
+    return [(this_monday + timedelta(weeks=n)).isoformat() for n in range(WEEKS)]
+
+def _escape_ics(text):
+    """Escape a text value for iCalendar."""
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+def _fold_ics(line):
+    """Fold an iCalendar content line to at most 75 octets per line."""
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75:
+        return line
+    parts = []
+    while len(encoded) > 75:
+        cut = 75 if not parts else 74  # Continuation lines start with a space
+        # Do not cut inside a multibyte character
+        while cut and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode("utf-8"))
+        encoded = encoded[cut:]
+    parts.append(encoded.decode("utf-8"))
+    return "\r\n ".join(parts)
+
+def compose_ics_events(menus, stamp):
+    """
+    Compose the calendar events of the days that have a menu.
+
+    :param menus: Dict mapping ISO dates to lists of (meal_id, name, comment) tuples
+    :param stamp: Generation time in iCalendar UTC format, e.g. 20260101T060000Z
+    :return: List of the event lines
+    """
+    lines = []
+    for day, items in menus.items():
+        start = date.fromisoformat(day)
+        description = "\n".join(f"{name} – {comment}" if comment else name for _, name, comment in items)
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:lounas-{day}@{UID_DOMAIN}",
+            f"DTSTAMP:{stamp}",
+            f"LAST-MODIFIED:{stamp}",
+            f"DTSTART;VALUE=DATE:{start.strftime('%Y%m%d')}",
+            f"DTEND;VALUE=DATE:{(start + timedelta(days=1)).strftime('%Y%m%d')}",
+            f"SUMMARY:{_escape_ics('Lounas: ' + items[0][1])}",
+            f"DESCRIPTION:{_escape_ics(description)}",
+            "TRANSP:TRANSPARENT",
+            "END:VEVENT",
+        ]
+    return lines
+
+def compose_ics(event_lines):
+    """Compose an iCalendar file from event lines."""
+    lines = [*ICS_HEADER, *event_lines, "END:VCALENDAR"]
+    return "".join(_fold_ics(line) + "\r\n" for line in lines)
+
+def _read_ics_events(path):
+    """Read the event lines of a published iCalendar file."""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        # Unfold the lines first
+        lines = f.read().replace("\r\n ", "").split("\r\n")
+    start, end = lines.index("BEGIN:VCALENDAR") + len(ICS_HEADER), lines.index("END:VCALENDAR")
+    return lines[start:end]
+
+def compose_week_page(monday, menus, weeks, generated_at):
+    """
+    Compose the static HTML page of a week.
+
+    :param monday: The week's Monday in ISO format
+    :param menus: Dict mapping the week's ISO dates to lists of (meal_id, name, comment) tuples
+    :param weeks: The Mondays of all published weeks, for the links to the previous and next week
+    :param generated_at: Generation time to show on the page
+    """
+    workdays = get_week_workdays(monday)
+    content = Markup("\n").join([
+        compose_menu_for_day(d, menus.get(d, []), meal_template_name="page_meal_template.html")
+        for d in workdays
+    ])
+    position = weeks.index(monday)
+    return render_template(
+        "week_page.html",
+        title=f"Lounaslista {workdays[0]} – {workdays[-1]}",
+        content=content,
+        previous_page=f"week-{weeks[position - 1]}.html" if position > 0 else None,
+        next_page=f"week-{weeks[position + 1]}.html" if position + 1 < len(weeks) else None,
+        generated_at=generated_at,
+        refresh=REFRESH,
+    )
+
+def publish(force=False):
+    """
+    Regenerate the static files of the weeks whose menus have changed since they were
+    published, and the index page and feed if anything changed.
+
+    :param force: Regenerate all files, changed or not.
+    :return: List of the Mondays of the weeks regenerated or removed
+    """
+    if not PUBLISH_DIR:
+        logging.debug("Publishing disabled, [publish] dir not set")
+        return []
+    os.makedirs(PUBLISH_DIR, exist_ok=True)
+    weeks = get_published_weeks()
+    now = datetime.now(timezone.utc)
+
+    with _locked(PUBLISH_DIR):
+        manifest = _load_manifest(PUBLISH_DIR)
+        published = manifest["weeks"]
+        changed = []
+        for monday in weeks:
+            workdays = get_week_workdays(monday)
+            version = get_menu_version(workdays[0], workdays[-1])
+            page_path = os.path.join(PUBLISH_DIR, f"week-{monday}.html")
+            ics_path = os.path.join(PUBLISH_DIR, f"week-{monday}.ics")
+            # The links to the neighbouring weeks change when the weeks on offer do
+            key = f"{version}|{weeks.index(monday)}|{len(weeks)}"
+            if not force and published.get(monday) == key and all(map(os.path.exists, (page_path, ics_path))):
+                continue
+
+            menus = get_menus_between(workdays[0], workdays[-1])
+            generated_at = now.astimezone().strftime("%Y-%m-%d %H:%M")
+            write_file_atomically(page_path, compose_week_page(monday, menus, weeks, generated_at))
+            write_file_atomically(ics_path, compose_ics(compose_ics_events(menus, now.strftime("%Y%m%dT%H%M%SZ"))))
+            published[monday] = key
+            changed.append(monday)
+
+        # Weeks that are no longer published
+        for monday in [m for m in published if m not in weeks]:
+            del published[monday]
+            for extension in ("html", "ics"):
+                path = os.path.join(PUBLISH_DIR, f"week-{monday}.{extension}")
+                if os.path.exists(path):
+                    os.remove(path)
+            changed.append(monday)
+
+        index_paths = [os.path.join(PUBLISH_DIR, name) for name in ("index.html", "menu.ics")]
+        if changed or manifest["index"] != weeks[0] or not all(map(os.path.exists, index_paths)):
+            with open(os.path.join(PUBLISH_DIR, f"week-{weeks[0]}.html"), "r", encoding="utf-8") as f:
+                write_file_atomically(os.path.join(PUBLISH_DIR, "index.html"), f.read())
+            events = []
+            for monday in weeks:
+                events += _read_ics_events(os.path.join(PUBLISH_DIR, f"week-{monday}.ics"))
+            write_file_atomically(os.path.join(PUBLISH_DIR, "menu.ics"), compose_ics(events))
+            manifest["index"] = weeks[0]
+
+        write_file_atomically(os.path.join(PUBLISH_DIR, MANIFEST), json.dumps(manifest, indent=1))
+
+    if changed:
+        logging.info(f"Published weeks {', '.join(changed)} to {PUBLISH_DIR}")
+    return changed
+
+def refresh_outputs():
+    """
+    Pre-render the mails and publish the static files after the menus or comments
+    change. Failures are logged, not raised, as the change itself is already stored
+    and must not be held up by its outputs.
+    """
+    try:
+        prerender_mails()
+    except Exception:
+        logging.exception("Failed to pre-render mails")
+    try:
+        publish()
+    except Exception:
+        logging.exception("Failed to publish the menus")
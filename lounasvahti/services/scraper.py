@@ -1,20 +1,170 @@
 """
 This module provides a Scraper class for extracting lunch menu data from a specified website.
 It includes methods for setting the target URL, selecting restaurant types and restaurants,
-and retrieving the menu for a given week. The scraper uses BeautifulSoup for parsing HTML
+and retrieving the menus of one or more weeks. The scraper uses BeautifulSoup for parsing HTML
 and requests for making HTTP requests.
 """
 
 import json
 import logging
 import os
+import random
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 
 import requests
 from bs4 import BeautifulSoup
+from bs4.builder import builder_registry
+from bs4.filter import ElementFilter
 
 from lounasvahti import config
-from lounasvahti.utils import finnish_date_to_iso
+from lounasvahti.services import fixtures
+from lounasvahti.utils import finnish_date_to_iso, write_file_atomically
+
+# HTML parser backend for BeautifulSoup, e.g. "html.parser" or "lxml" if installed
+PARSER = config.get("scraper", "parser", fallback="html.parser")
+
+# Concurrent scrapes in total and per host
+WORKERS = config.getint("scraper", "workers", fallback=4)
+PER_HOST = config.getint("scraper", "per_host", fallback=2)
+
+# Seconds a saved session state is reused before starting a new session
+SESSION_TTL = config.getint("scraper", "session_ttl", fallback=1800)
+
+# Seconds to wait for a connection and between bytes of a response
+TIMEOUT = (
+    config.getfloat("scraper", "connect_timeout", fallback=5),
+    config.getfloat("scraper", "read_timeout", fallback=20),
+)
+
+# Retries of idempotent requests, and the backoff in seconds before the first retry
+# (doubled for each further retry, with full jitter)
+RETRIES = config.getint("scraper", "retries", fallback=2)
+BACKOFF = config.getfloat("scraper", "backoff", fallback=1)
+
+# Consecutive failed requests to a host that open its circuit breaker, and seconds it stays open
+BREAKER_THRESHOLD = config.getint("scraper", "breaker_threshold", fallback=3)
+BREAKER_COOLDOWN = config.getint("scraper", "breaker_cooldown", fallback=900)
+
+# Response statuses worth retrying; other errors are not going to go away
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Serializes access to scraper_sessions.json between threads
+_sessions_lock = threading.Lock()
+
+# Serializes access to scraper_breaker.json between threads
+_breaker_lock = threading.Lock()
+
+# Start of an ASP.NET UpdatePanel delta response: the length of the first record
+DELTA_START = re.compile(r"\d+\|")
+
+def parse_delta(text):
+    """
+    Parse an ASP.NET UpdatePanel delta response, which is a sequence of
+    "length|type|id|content|" records where length is the length of content.
+    Records are yielded one at a time without splitting the whole response.
+
+    :param text: The response text
+    :return: Generator of (type, id, content) tuples
+    """
+    pos = 0
+    while pos < len(text):
+        length_end = text.index("|", pos)
+        length = int(text[pos:length_end])
+        type_end = text.index("|", length_end + 1)
+        id_end = text.index("|", type_end + 1)
+        content_end = id_end + 1 + length
+        if text[content_end:content_end + 1] != "|":
+            raise ValueError(f"Malformed delta record at position {pos}")
+        yield text[length_end + 1:type_end], text[type_end + 1:id_end], text[id_end + 1:content_end]
+        pos = content_end + 1
+
+class ScrapeFilter(ElementFilter):
+    """
+    Parse-time filter (like a SoupStrainer) that keeps only the top-level elements the
+    scraper reads: aspNetHidden fieldsets, DayDataPanel divs and the named selects.
+    Everything inside a kept element is kept as well.
+    """
+
+    CLASSES = {"aspNetHidden", "DayDataPanel"}
+
+    def __init__(self, select_names):
+        self.select_names = set(select_names)
+
+    def allow_tag_creation(self, nsprefix, name, attrs):
+        attrs = attrs or {}
+        if name == "select":
+            return attrs.get("name") in self.select_names
+        classes = attrs.get("class") or ""
+        if isinstance(classes, str):
+            classes = classes.split()
+        return not self.CLASSES.isdisjoint(classes)
+
+    def allow_string_creation(self, string):
+        return False
+
+class CircuitOpenError(requests.RequestException):
+    """Raised instead of making a request to a host whose circuit breaker is open."""
+
+class CircuitBreaker:
+    """
+    Circuit breakers of the scraped hosts, kept in a JSON file so that they hold across
+    runs of the daily task. After threshold consecutive failed requests to a host, its
+    circuit opens and requests fail fast with CircuitOpenError for cooldown seconds.
+    After that a request is let through again: success closes the circuit, another
+    failure opens it for a new cooldown.
+    """
+
+    def __init__(self, path, threshold=None, cooldown=None):
+        """:param path: The JSON file of the state, or None to disable the breaker."""
+        self.path = path
+        self.threshold = threshold or BREAKER_THRESHOLD
+        self.cooldown = cooldown or BREAKER_COOLDOWN
+
+    def _load(self):
+        """Load the state of all hosts. Call with _breaker_lock held."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _store(self, state):
+        """Store the state of all hosts atomically. Call with _breaker_lock held."""
+        write_file_atomically(self.path, json.dumps(state))
+
+    def check(self, host):
+        """Raise CircuitOpenError if the circuit of host is open."""
+        if self.path is None:
+            return
+        with _breaker_lock:
+            entry = self._load().get(host)
+        if entry and entry["opened_at"] and time.time() - entry["opened_at"] < self.cooldown:
+            raise CircuitOpenError(f"Circuit breaker open for {host} after {entry['failures']} failures")
+
+    def record(self, host, ok):
+        """Record the outcome of a request to host, opening or closing its circuit."""
+        if self.path is None:
+            return
+        with _breaker_lock:
+            state = self._load()
+            entry = state.get(host, {"failures": 0, "opened_at": None})
+            if ok:
+                if host not in state:
+                    return
+                del state[host]
+                if entry["opened_at"]:
+                    logging.info(f"Circuit breaker closed for {host}")
+            else:
+                entry["failures"] += 1
+                if entry["failures"] >= self.threshold:
+                    entry["opened_at"] = time.time()
+                    logging.warning(f"Circuit breaker opened for {host} after {entry['failures']} failures")
+                state[host] = entry
+            self._store(state)
 
 class Scraper:
 
@@ -25,12 +175,25 @@ class Scraper:
     USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
     LANGUAGE = "fi"
     
-    def __init__(self):
+    def __init__(self, target=None):
+        """
+        :param target: Data of the restaurant to scrape, with the same keys as self.data.
+                       By default the configured restaurant is loaded from scraper_data.json.
+                       A scraper with an explicit target never writes to the file.
+        """
         self.session = requests.Session()
         self.session.headers.update({"User-Agent": self.USER_AGENT})
+        fixtures.mount(self.session)
+        # Recording and replaying fixtures must not touch the live session and breaker state
+        self.fixture_mode = fixtures.get_mode()
         self.state = None
         self.url = None
         self.data_file = os.path.join(config["database"]["path"], "scraper_data.json")
+        self.sessions_file = os.path.join(config["database"]["path"], "scraper_sessions.json")
+        self.breaker = CircuitBreaker(
+            None if self.fixture_mode else os.path.join(config["database"]["path"], "scraper_breaker.json")
+        )
+        self.persistent = target is None
         self.data = {
             "url": None,
             "endpoint": None,
@@ -41,9 +204,27 @@ class Scraper:
         }
         self.state_vars = {}
         self.temp_data = {}
-        self._load_data()
+        self.parser = self._select_parser(PARSER)
+        self.parse_filter = ScrapeFilter([
+            self.RESTAURANT_TYPE_SELECT,
+            self.RESTAURANT_SELECT,
+            self.LANGUAGE_SELECT,
+            self.WEEK_SELECT,
+        ])
+        if self.persistent:
+            self._load_data()
+        else:
+            self.data = {key: target.get(key) for key in self.data.keys()}
         logging.info("Scraper initialized")
 
+    @staticmethod
+    def _select_parser(parser):
+        """Return the configured parser backend, or html.parser if it is not installed."""
+        if builder_registry.lookup(parser) is None:
+            logging.warning(f"Parser '{parser}' not available, using html.parser")
+            return "html.parser"
+        return parser
+
     def _load_data(self):
         """Load stored data from a JSON file, ensuring required keys exist."""
         try:
@@ -58,34 +239,150 @@ class Scraper:
     
     def _save_data(self):
         """Save stored data to a JSON file."""
+        if not self.persistent:
+            return
         with open(self.data_file, "w", encoding="utf-8") as f:
             json.dump(self.data, f, indent=4)
         logging.info("Data saved to file")
 
-    def _get_state_vars(self, response_text):
-        """Extract state variables from the HTML response."""
-        soup = BeautifulSoup(response_text, "html.parser")
+    def _load_sessions(self):
+        """Load all saved session states. Call with _sessions_lock held."""
+        try:
+            with open(self.sessions_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _restore_session(self):
+        """
+        Restore the saved cookies and state variables of this restaurant's endpoint.
+        Returns False if there is no saved state or it is older than SESSION_TTL,
+        and always in fixture mode.
+        """
+        if self.fixture_mode:
+            return False
+        with _sessions_lock:
+            saved = self._load_sessions().get(self.data["endpoint"])
+        if not saved or time.time() - saved["saved_at"] > SESSION_TTL:
+            return False
+        self.session.cookies.update(saved["cookies"])
+        self.state_vars = dict(saved["state_vars"])
+        logging.debug("Session state restored")
+        return True
+
+    def _save_session(self):
+        """
+        Save the cookies and state variables of this restaurant's endpoint to
+        scraper_sessions.json, so that the next scrape can post right away without
+        fetching the page first. Nothing is saved in fixture mode.
+        """
+        if self.fixture_mode:
+            return
+        with _sessions_lock:
+            sessions = self._load_sessions()
+            sessions[self.data["endpoint"]] = {
+                "saved_at": time.time(),
+                "cookies": requests.utils.dict_from_cookiejar(self.session.cookies),
+                "state_vars": self.state_vars,
+            }
+            write_file_atomically(self.sessions_file, json.dumps(sessions))
+        logging.debug("Session state saved")
+
+    def _forget_session(self):
+        """Drop the current cookies and state variables, so that the next request starts a new session."""
+        self.session.cookies.clear()
+        self.state_vars = {}
+
+    def _parse(self, response_text):
+        """Parse the parts of an HTML response the scraper needs."""
+        return BeautifulSoup(response_text, self.parser, parse_only=self.parse_filter)
+
+    def _get_state_vars(self, soup):
+        """Extract state variables from the parsed response."""
         for fieldset in soup.find_all(class_="aspNetHidden"):
             for input_tag in fieldset.find_all("input"):
                 self.state_vars[input_tag["name"]] = input_tag["value"]
         logging.debug("State variables updated")
 
-    def _get(self, *args, **kwargs):
-        """Perform a GET request and update state variables."""
-        response = self.session.get(*args, **kwargs)
-        response.raise_for_status()
-        self._get_state_vars(response.text)
+    def _request(self, method, url, retry=False, **kwargs):
+        """
+        Make a request with the configured timeouts, unless the host's circuit breaker is open.
+        With retry=True, timeouts, connection errors and transient error statuses are retried
+        with jittered exponential backoff; only set it for idempotent requests.
+        Every attempt is timed and logged. Returns the successful response.
+        """
+        host = urlsplit(url).netloc
+        self.breaker.check(host)
+        kwargs.setdefault("timeout", TIMEOUT)
+        send = self.session.get if method == "GET" else self.session.post
+        attempts = 1 + (RETRIES if retry else 0)
+        for attempt in range(1, attempts + 1):
+            start = time.monotonic()
+            try:
+                response = send(url, **kwargs)
+                response.raise_for_status()
+            except requests.RequestException as e:
+                elapsed = time.monotonic() - start
+                status = e.response.status_code if e.response is not None else None
+                transient = status is None or status in RETRY_STATUSES
+                logging.warning(f"{method} {url} attempt {attempt}/{attempts} failed in {elapsed:.2f}s: {e}")
+                if not transient:
+                    # The host is up, the request is just not accepted
+                    self.breaker.record(host, ok=True)
+                    raise
+                if attempt == attempts:
+                    self.breaker.record(host, ok=False)
+                    raise
+                time.sleep(random.uniform(0, BACKOFF * 2 ** (attempt - 1)))
+                continue
+            elapsed = time.monotonic() - start
+            logging.info(f"{method} {url} attempt {attempt}/{attempts}: {response.status_code} in {elapsed:.2f}s")
+            self.breaker.record(host, ok=True)
+            return response
+
+    def _get(self, url, **kwargs):
+        """Perform a GET request and update state variables. Returns the response and its parsed soup."""
+        response = self._request("GET", url, retry=True, **kwargs)
+        soup = self._parse(response.text)
+        self._get_state_vars(soup)
         logging.info(f"GET request to {response.url} successful")
-        return response
+        return response, soup
 
-    def _post(self, *args, data={}, **kwargs):
-        """Perform a POST request and update state variables."""
+    def _post(self, url, data={}, delta=False, retry=False, **kwargs):
+        """
+        Perform a POST request and update state variables. Returns the response and its parsed soup.
+        With delta=True, the request is made as a partial postback (the data must name the
+        update panel in ctl00$ScriptManager1) and the delta response is parsed with _parse_delta().
+        Set retry=True for postbacks that only change what is shown, see _request().
+        """
         data = {**self.state_vars, **data}
-        response = self.session.post(*args, data=data, **kwargs)
-        response.raise_for_status()
-        self._get_state_vars(response.text)
+        if delta:
+            data["__ASYNCPOST"] = "true"
+            kwargs["headers"] = {"X-MicrosoftAjax": "Delta=true", **kwargs.get("headers", {})}
+        response = self._request("POST", url, retry=retry, data=data, **kwargs)
+        if delta and DELTA_START.match(response.text):
+            soup = self._parse_delta(response.text)
+        else:
+            soup = self._parse(response.text)
+            self._get_state_vars(soup)
         logging.info(f"POST request to {response.url} successful")
-        return response
+        return response, soup
+
+    def _parse_delta(self, response_text):
+        """
+        Read a partial postback delta response. Hidden fields update the state variables
+        directly and only the update panels' HTML is parsed.
+        """
+        panels = []
+        for record_type, record_id, content in parse_delta(response_text):
+            if record_type == "hiddenField":
+                self.state_vars[record_id] = content
+            elif record_type == "updatePanel":
+                panels.append(content)
+            elif record_type in ("error", "pageRedirect"):
+                raise requests.HTTPError(f"Partial postback failed ({record_type}): {content}")
+        logging.debug(f"Delta response parsed, {len(panels)} update panels")
+        return self._parse("".join(panels))
 
     def _find_menu_in_soup(self, soup):
         """Find the menu in the HTML soup."""
@@ -109,31 +406,90 @@ class Scraper:
         logging.debug("Menu scrape completed")
         return menu
 
-    def get_menu(self, this_week=False):
-        """Get the menu for the selected restaurant."""
-        url = self.data["endpoint"]
-        self._get(url)
-        ctl = "1" if this_week else "2"
-        data = {
+    def _week_data(self, week):
+        """Form data of the partial postback that selects a week. Week 0 is this week."""
+        button = (
+            f"ctl00$MainContent$RestaurantDateRangesFilterHeadersDataList$ctl{week + 1:02d}"
+            "$RestaurantDateRangesFilterHeadersLinkButton"
+        )
+        return {
             self.RESTAURANT_TYPE_SELECT: self.data["restaurant_type_uuid"],
             self.RESTAURANT_SELECT: self.data["restaurant_uuid"],
             self.LANGUAGE_SELECT: self.LANGUAGE,
-            self.WEEK_SELECT: "0" if this_week else "1",
-            "__EVENTTARGET": f"ctl00$MainContent$RestaurantDateRangesFilterHeadersDataList$ctl0{ctl}$RestaurantDateRangesFilterHeadersLinkButton",
-            "ctl00$ScriptManager1": f"ctl00$MasterUpdatePanel|ctl00$MainContent$RestaurantDateRangesFilterHeadersDataList$ctl0{ctl}$RestaurantDateRangesFilterHeadersLinkButton",
+            self.WEEK_SELECT: str(week),
+            "__EVENTTARGET": button,
+            "ctl00$ScriptManager1": f"ctl00$MasterUpdatePanel|{button}",
             "ctl00$MainContent$DropDownListGetWeeks:": 1
         }
-        response = self._post(url, data=data)
-        soup = BeautifulSoup(response.text, "html.parser")
-        menu = self._find_menu_in_soup(soup)
+
+    def _get_week_options(self, soup):
+        """Get the week indexes offered by the week dropdown, or None if it is not in the soup."""
+        select = soup.find("select", {"name": self.WEEK_SELECT})
+        if select is None:
+            return None
+        return [int(option["value"]) for option in select.find_all("option") if option.get("value", "").isdigit()]
+
+    def get_menu(self, this_week=False):
+        """Get the menu for the selected restaurant for this or next week."""
+        return self.get_menus(weeks=[0 if this_week else 1])
+
+    def get_menus(self, weeks=None):
+        """
+        Get the menus of several weeks for the selected restaurant in one session.
+        A fresh saved session state is used instead of fetching the page first; if the
+        server rejects it, the page is fetched and the request repeated.
+
+        :param weeks: Iterable of week indexes, 0 being this week. Weeks the week dropdown
+                      does not offer are skipped. By default, all offered weeks are fetched.
+        :return: Dict mapping ISO dates to lists of menu items, for all fetched weeks
+        """
+        url = self.data["endpoint"]
+        pending = list(weeks) if weeks is not None else [0]
+        restored = self._restore_session()
+        offered = None
+        if not restored:
+            _, page = self._get(url)
+            offered = self._get_week_options(page)
+
+        menus = {}
+        while pending:
+            week = pending.pop(0)
+            if offered is not None and week not in offered:
+                logging.info(f"Week {week} not offered, skipping")
+                continue
+            data = self._week_data(week)
+            try:
+                _, soup = self._post(url, data=data, delta=True, retry=True)
+                menu = self._find_menu_in_soup(soup)
+            except (requests.HTTPError, ValueError) as e:
+                if not restored:
+                    raise
+                logging.info(f"Saved session state rejected ({e}), starting a new session")
+                menu = None
+            if restored and not menu:
+                self._forget_session()
+                _, page = self._get(url)
+                offered = self._get_week_options(page)
+                _, soup = self._post(url, data=data, delta=True, retry=True)
+                menu = self._find_menu_in_soup(soup)
+            # After the first successful postback, the session state is known to be good
+            restored = False
+
+            if offered is None:
+                offered = self._get_week_options(soup)
+            if weeks is None and offered and not menus:
+                pending = [w for w in offered if w != week]
+            menus.update(menu)
+            logging.info(f"Menu for week {week} retrieved, {len(menu)} days")
+
+        self._save_session()
         logging.info("Menu retrieved successfully")
-        return menu
+        return menus
 
     def get_restaurant_types(self):
         """Get a list of restaurant types from the target site."""
         url = self.data["url"]
-        response = self._get(url)
-        soup = BeautifulSoup(response.text, "html.parser")
+        _, soup = self._get(url)
         restaurant_types = soup.find("select", {"name": self.RESTAURANT_TYPE_SELECT}).find_all("option")
         logging.info("Restaurant types retrieved successfully")
         return {option.text: option["value"] for option in restaurant_types if option["value"]}
@@ -142,10 +498,8 @@ class Scraper:
         """Get a list of restaurants for the selected restaurant type."""
         url = self.data["url"]
         restaurant_type_uuid = self.data["restaurant_type_uuid"]
-        data = self.data
-        data[self.RESTAURANT_TYPE_SELECT] = restaurant_type_uuid
-        response = self._post(url, data=data)
-        soup = BeautifulSoup(response.text, "html.parser")
+        data = {**self.data, self.RESTAURANT_TYPE_SELECT: restaurant_type_uuid}
+        _, soup = self._post(url, data=data)
         restaurants = soup.find("select", {"name": self.RESTAURANT_SELECT}).find_all("option")
         logging.info("Restaurants retrieved successfully")
         return {option.text: option["value"] for option in restaurants if option["value"]}
@@ -173,7 +527,113 @@ class Scraper:
             self.RESTAURANT_SELECT: self.data["restaurant_uuid"]
         }
 
-        response = self._post(self.data["url"], data=data)
+        response, _ = self._post(self.data["url"], data=data)
         self.data["endpoint"] = response.url
         self._save_data()
         logging.info(f"Restaurant set to {name} with UUID {uuid}")
+
+def resolve_target(url, restaurant_type_name, restaurant_name):
+    """
+    Look up the UUIDs and menu endpoint of a restaurant by its type and name.
+
+    :return: Target data for Scraper(target=...)
+    """
+    scraper = Scraper(target={"url": url})
+    restaurant_types = scraper.get_restaurant_types()
+    scraper.set_restaurant_type(restaurant_type_name, restaurant_types[restaurant_type_name])
+    restaurants = scraper.get_restaurants()
+    scraper.set_restaurant(restaurant_name, restaurants[restaurant_name])
+    return scraper.data
+
+def get_other_target_names():
+    """Get the (type, name) pairs listed in [target] others, one "type / name" per line."""
+    others = config.get("target", "others", fallback="")
+    pairs = []
+    for line in others.splitlines():
+        if not line.strip():
+            continue
+        restaurant_type_name, _, restaurant_name = line.partition("/")
+        pairs.append((restaurant_type_name.strip(), restaurant_name.strip()))
+    return pairs
+
+def get_targets():
+    """
+    Get the data of all restaurants to scrape, keyed by restaurant name: the configured
+    restaurant from scraper_data.json, and those listed in [target] others. The latter are
+    looked up on the target site once and cached in scraper_targets.json.
+    """
+    primary = Scraper().data
+    primary_name = config.get("target", "name", fallback=primary["restaurant_name"])
+    targets = {primary_name: primary}
+
+    cache_file = os.path.join(config["database"]["path"], "scraper_targets.json")
+    try:
+        with open(cache_file, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        cache = {}
+
+    changed = False
+    for restaurant_type_name, restaurant_name in get_other_target_names():
+        cached = cache.get(restaurant_name)
+        if not cached or cached.get("restaurant_type_name") != restaurant_type_name:
+            try:
+                cache[restaurant_name] = resolve_target(primary["url"], restaurant_type_name, restaurant_name)
+                changed = True
+            except (requests.RequestException, KeyError, AttributeError) as e:
+                logging.error(f"Could not look up restaurant {restaurant_type_name} / {restaurant_name}: {e}")
+                continue
+        targets[restaurant_name] = cache[restaurant_name]
+
+    if changed:
+        with open(cache_file, "w", encoding="utf-8") as f:
+            json.dump(cache, f, indent=4)
+    return targets
+
+# Per-host semaphores limiting concurrent scrapes against the same server
+_host_limits = {}
+_host_limits_lock = threading.Lock()
+
+def _host_limit(url):
+    """Get the semaphore limiting concurrent scrapes of the host of url."""
+    host = urlsplit(url).netloc
+    with _host_limits_lock:
+        if host not in _host_limits:
+            _host_limits[host] = threading.BoundedSemaphore(PER_HOST)
+        return _host_limits[host]
+
+def _scrape_target(target, weeks):
+    """Scrape one restaurant in its own session, within the per-host limit."""
+    with _host_limit(target["endpoint"]):
+        start = time.monotonic()
+        menus = Scraper(target=target).get_menus(weeks=weeks)
+        logging.info(f"Scraped {target.get('restaurant_name')} in {time.monotonic() - start:.2f}s")
+        return menus
+
+def scrape_all(weeks=None, workers=None):
+    """
+    Scrape the menus of all restaurants concurrently. Restaurants that fail, or whose host's
+    circuit breaker is open, are logged and left out, so their stored menus stay in use.
+
+    :param weeks: Week indexes to scrape, see Scraper.get_menus(). All offered weeks by default.
+    :param workers: Number of concurrent scrapes, [scraper] workers by default.
+    :return: Dict mapping restaurant names to menus as returned by Scraper.get_menus()
+    """
+    targets = get_targets()
+    workers = max(1, min(workers or WORKERS, len(targets)))
+    logging.info(f"Scraping {len(targets)} restaurants with {workers} workers")
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scraper") as executor:
+        futures = {
+            name: executor.submit(_scrape_target, target, weeks)
+            for name, target in targets.items()
+        }
+
+    menus = {}
+    for name, future in futures.items():
+        try:
+            menus[name] = future.result()
+        except Exception as e:
+            logging.error(f"Scraping {name} failed, keeping its stored menus: {e}")
+    logging.info(f"Scraped {len(menus)} of {len(targets)} restaurants")
+    return menus
@@ -1,16 +1,35 @@
 """
 This module implements a web server for the Lunch Menu Comment System using Flask.
-It provides routes to check the server status and to edit comments for meals.
+It provides routes to check the server status, to edit comments for meals, to search meals,
+to view the daily and weekly mails in a browser, and a JSON API for menus and meals.
 """
 
+import base64
+import binascii
+import hashlib
+import json
 import logging
 import os
+import re
+from datetime import date as date_type, datetime, timezone
 
-from flask import Flask, request, redirect, url_for
+from flask import Flask, Response, jsonify, make_response, request, redirect, url_for
+from markupsafe import Markup
 
 from lounasvahti import config
-from lounasvahti.database import get_meal_by_id, update_meal_comment
-from lounasvahti.utils import load_template
+from lounasvahti.cache import get_cache_stats
+from lounasvahti.database import (
+    get_meal_by_id,
+    get_meal_record,
+    get_meal_updated_at,
+    get_menu_rows,
+    get_menu_version,
+    search_meals,
+    update_meal_comment,
+)
+from lounasvahti.services.email_sender import MAIL_KINDS, get_prerendered_mails, get_rendered_mail
+from lounasvahti.services.publisher import refresh_outputs
+from lounasvahti.templating import render_template
 
 # Load settings from config.ini
 HOST = config["server"]["address"]
@@ -19,12 +38,23 @@ PORT = int(config["server"]["port"])
 # Detect if running under systemd
 IS_SYSTEMD = os.getenv("INVOCATION_ID") is not None  # Systemd sets INVOCATION_ID
 
+# Search results per page, default and maximum
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+
+# Menu API rows per page, default and maximum
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 500
+
+# Cache-Control of the comment form and API responses: may be stored, but must be revalidated before reuse
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
 # HTML snippet to close the window
-CLOSER = """
+CLOSER = Markup("""
     <script>
         window.close();
     </script>
-"""
+""")
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -35,9 +65,38 @@ def home():
     logging.info("Received request at /")
     return "Lunch Menu Comment System is running!"
 
+@app.route("/cache")
+def cache_stats():
+    """Route to show the hit and miss counters of this process's meal and menu caches as JSON."""
+    return jsonify(get_cache_stats())
+
+def comment_form_validators(meal_id, updated_at, close):
+    """
+    Get the ETag and Last-Modified time of a meal's comment form, or (None, None) if the
+    meal has no update time.
+    """
+    if not updated_at:
+        return None, None
+    etag = hashlib.sha1(f"{meal_id}|{updated_at}|{bool(close)}".encode()).hexdigest()[:20]
+    last_modified = datetime.fromisoformat(updated_at).replace(tzinfo=timezone.utc)
+    return etag, last_modified
+
+def is_not_modified(etag, last_modified):
+    """Check the request's If-None-Match, or failing that If-Modified-Since, against the validators."""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since:
+        # HTTP dates have whole seconds
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
 @app.route("/comment", methods=["GET", "POST"])
 def edit_comment():
-    """Route to edit comments for a meal."""
+    """
+    Route to edit comments for a meal. The form is sent with an ETag and Last-Modified
+    derived from the meal's update time, and conditional requests for an unchanged form
+    are answered with 304 Not Modified after a single primary key lookup, without rendering.
+    """
     meal_id = request.args.get("meal_id")  # "meal_id" comes from the email link
     if not meal_id:
         logging.error("Missing meal_id parameter")
@@ -53,28 +112,182 @@ def edit_comment():
             return "Error: Meal not found.", 404
         update_meal_comment(meal_id, new_comment)
         logging.info(f"Updated comment for meal_id {meal_id}")
+        refresh_outputs()
 
         return redirect(url_for("edit_comment", meal_id=meal_id, close=True))
 
-    # Fetch the meal
-    meal = get_meal_by_id(meal_id)
+    close = request.args.get("close")
+    current_updated_at = get_meal_updated_at(meal_id)
+    etag, last_modified = comment_form_validators(meal_id, current_updated_at, close)
+    if etag and is_not_modified(etag, last_modified):
+        logging.info(f"Comment form for meal_id {meal_id} not modified")
+        response = make_response("", 304)
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = REVALIDATE_CACHE_CONTROL
+        return response
+
+    # Fetch the meal, refreshing a cached copy older than the update time just read, so
+    # that a comment saved by another process is not overwritten from a stale form.
+    # The validators are recomputed from the fetched copy, which may be newer still.
+    meal = get_meal_record(meal_id, current_updated_at)
     if not meal:
         logging.error(f"Meal not found for meal_id {meal_id}")
         return "Error: Meal not found.", 404
 
-    meal_name, meal_comment = meal
+    meal_name, meal_comment, updated_at = meal
+    etag, last_modified = comment_form_validators(meal_id, updated_at, close)
     meal_comment = meal_comment if meal_comment else ""
-    head = CLOSER if request.args.get("close") else ""
+    head = CLOSER if close else ""
 
-    comment_form_template = load_template("comment_form.html")
     logging.info(f"Rendering comment form for meal_id {meal_id}")
 
-    return comment_form_template.format(
+    response = make_response(render_template(
+        "comment_form.html",
         meal_name=meal_name,
         meal_comment=meal_comment,
         head=head
+    ))
+    if etag:
+        response.set_etag(etag)
+        response.last_modified = last_modified
+    response.headers["Cache-Control"] = REVALIDATE_CACHE_CONTROL
+    return response
+
+@app.route("/search")
+def search():
+    """Route to search meals by name and comment. Returns ranked results as JSON."""
+    query = request.args.get("q", "").strip()
+    if not query:
+        logging.error("Missing q parameter")
+        return "Error: Missing q parameter.", 400
+
+    page = request.args.get("page", 1, type=int)
+    per_page = request.args.get("per_page", SEARCH_PAGE_SIZE, type=int)
+    if page < 1 or not 1 <= per_page <= SEARCH_MAX_PAGE_SIZE:
+        logging.error(f"Invalid pagination: page={page}, per_page={per_page}")
+        return "Error: Invalid page or per_page parameter.", 400
+
+    # Fetch one extra row to find out whether there is a next page
+    meals = search_meals(query, limit=per_page + 1, offset=(page - 1) * per_page)
+    has_next = len(meals) > per_page
+    logging.info(f"Search for '{query}' page {page}: {len(meals[:per_page])} results")
+
+    return jsonify(
+        query=query,
+        page=page,
+        per_page=per_page,
+        next_page=page + 1 if has_next else None,
+        results=[
+            {"id": meal_id, "name": name, "comment": comment or ""}
+            for meal_id, name, comment in meals[:per_page]
+        ],
     )
 
+def parse_date(value):
+    """Parse a date in ISO format (YYYY-MM-DD). Returns None if it is not a valid date."""
+    if not re.fullmatch(r"\d{4}-\d{2}-\d{2}", value):
+        return None
+    try:
+        return date_type.fromisoformat(value)
+    except ValueError:
+        return None
+
+@app.route("/mail/<kind>/<date>")
+def view_mail(kind, date):
+    """Route to view a daily mail by date, or a weekly mail by the week's Monday, in a browser."""
+    day = parse_date(date)
+    # Weekly mails are stored by the week's Monday
+    if kind not in MAIL_KINDS or not day or (kind != "daily" and day.weekday() != 0):
+        logging.error(f"Invalid mail requested: {kind} {date}")
+        return "Error: Mail not found.", 404
+
+    # Only the mails kept by prerender_mails() are stored, others are rendered for the request
+    logging.info(f"Serving {kind} mail for {date}")
+    return get_rendered_mail(kind, date, store=(kind, date) in get_prerendered_mails())
+
+def api_response(data, etag):
+    """A compact JSON response with an ETag, or 304 Not Modified if the request has the same ETag."""
+    if request.if_none_match.contains_weak(etag):
+        response = make_response("", 304)
+    else:
+        body = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = REVALIDATE_CACHE_CONTROL
+    return response
+
+def encode_cursor(date, row_id):
+    """Encode the key of the last row of a page as an opaque cursor."""
+    return base64.urlsafe_b64encode(f"{date}|{row_id}".encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    """Decode a cursor made by encode_cursor(). Raises ValueError if it is invalid."""
+    try:
+        date, row_id = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().split("|")
+        return date, int(row_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+@app.route("/api/menus")
+def api_menus():
+    """
+    Route to get the menus between the dates from and to (inclusive) as JSON, a page of
+    limit menu rows at a time. The response's next is the cursor of the next page, or null.
+    """
+    start = request.args.get("from", "")
+    end = request.args.get("to", start)
+    restaurant = request.args.get("restaurant")
+    limit = request.args.get("limit", API_PAGE_SIZE, type=int)
+    if not parse_date(start) or not parse_date(end) or start > end:
+        logging.error(f"Invalid menu API date range: {start} - {end}")
+        return "Error: Invalid from or to parameter.", 400
+    if not 1 <= limit <= API_MAX_PAGE_SIZE:
+        logging.error(f"Invalid menu API limit: {limit}")
+        return "Error: Invalid limit parameter.", 400
+    cursor = request.args.get("cursor")
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        logging.error(str(e))
+        return "Error: Invalid cursor parameter.", 400
+
+    # The ETag depends on the menus' version, so an unchanged page costs one aggregate query
+    version = get_menu_version(start, end, restaurant)
+    etag = hashlib.sha1(f"{start}|{end}|{restaurant}|{cursor}|{limit}|{version}".encode()).hexdigest()[:20]
+    if request.if_none_match.contains_weak(etag):
+        return api_response(None, etag)
+
+    # Fetch one extra row to find out whether there is a next page
+    rows = get_menu_rows(start, end, restaurant, after=after, limit=limit + 1)
+    has_next = len(rows) > limit
+    rows = rows[:limit]
+    days = []
+    for date, _, meal_id, name, comment in rows:
+        if not days or days[-1]["date"] != date:
+            days.append({"date": date, "meals": []})
+        days[-1]["meals"].append([meal_id, name, comment or ""])
+    logging.info(f"Menu API {start} - {end}: {len(rows)} rows")
+
+    return api_response({
+        "from": start,
+        "to": end,
+        "days": days,
+        "next": encode_cursor(rows[-1][0], rows[-1][1]) if has_next else None,
+    }, etag)
+
+@app.route("/api/meals/<int:meal_id>")
+def api_meal(meal_id):
+    """Route to get a meal as JSON."""
+    meal = get_meal_record(meal_id)
+    if not meal:
+        logging.error(f"Meal not found for meal_id {meal_id}")
+        return jsonify(error="Meal not found."), 404
+
+    name, comment, updated_at = meal
+    etag = hashlib.sha1(f"{meal_id}|{updated_at}".encode()).hexdigest()[:20]
+    return api_response({"id": meal_id, "name": name, "comment": comment or "", "updated_at": updated_at}, etag)
+
+# The Werkzeug development server. In production the app is served by lounasvahti.services.wsgi.
 if __name__ == "__main__":
     debug_mode = not IS_SYSTEMD  # Debug mode only when NOT running under systemd
     logging.info(f"Starting web server on {HOST}:{PORT} (Debug: {debug_mode})")
@@ -0,0 +1,72 @@
+"""
+This module runs the web server in production, under gunicorn with several worker
+processes of several threads each. Worker and thread counts, keep-alive and timeouts
+are set in the [server] section of config.ini.
+
+The app is loaded in each worker after the fork rather than in the master, so no
+SQLite connection or cache contents are inherited. Connections are per thread and per
+process anyway (see lounasvahti.database.get_conn()), and each worker drops anything
+it inherited regardless.
+
+To use another WSGI server, point it at lounasvahti.services.web_server:app.
+"""
+
+import logging
+
+from gunicorn.app.base import BaseApplication
+
+from lounasvahti import config
+from lounasvahti.cache import clear_caches
+from lounasvahti.database import close_conn
+
+# Load settings from config.ini
+HOST = config["server"]["address"]
+PORT = int(config["server"]["port"])
+WORKERS = config.getint("server", "workers", fallback=4)  # Processes
+THREADS = config.getint("server", "threads", fallback=4)  # Threads per process
+KEEPALIVE = config.getint("server", "keepalive", fallback=5)  # Seconds to wait for the next request on a connection
+TIMEOUT = config.getint("server", "timeout", fallback=30)  # Seconds a request may take before its worker is restarted
+GRACEFUL_TIMEOUT = config.getint("server", "graceful_timeout", fallback=30)  # Seconds to finish requests on restart
+MAX_REQUESTS = config.getint("server", "max_requests", fallback=0)  # Requests before a worker is recycled, 0 = never
+
+def post_fork(server, worker):
+    """Drop the database connection and cache entries a worker may have inherited from the master."""
+    close_conn()
+    clear_caches()
+
+class WebApplication(BaseApplication):
+    """Gunicorn application serving the Flask app with the [server] settings."""
+
+    def __init__(self, options=None):
+        self.options = options or {}
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # Imported here so that the app is loaded in the workers, not in the master
+        from lounasvahti.services.web_server import app
+        return app
+
+def get_options():
+    """Get the gunicorn settings from config.ini."""
+    return {
+        "bind": f"{HOST}:{PORT}",
+        "workers": WORKERS,
+        "threads": THREADS,
+        "worker_class": "gthread",
+        "keepalive": KEEPALIVE,
+        "timeout": TIMEOUT,
+        "graceful_timeout": GRACEFUL_TIMEOUT,
+        "max_requests": MAX_REQUESTS,
+        "max_requests_jitter": MAX_REQUESTS // 10,
+        "preload_app": False,
+        "post_fork": post_fork,
+        "errorlog": "-",
+    }
+
+if __name__ == "__main__":
+    logging.info(f"Starting web server on {HOST}:{PORT} with {WORKERS} workers of {THREADS} threads")
+    WebApplication(get_options()).run()
@@ -0,0 +1,48 @@
+"""
+This module provides compiled, cached templates for email and web rendering.
+Templates are Jinja2 templates with HTML autoescaping. Each template is compiled once
+and recompiled only when its file's modification time changes. The modification time
+is checked at most every TEMPLATE_CHECK_INTERVAL seconds, so rendering normally
+does no disk I/O.
+"""
+
+import logging
+import time
+
+from jinja2 import Environment, FileSystemLoader, TemplateNotFound, select_autoescape
+
+from lounasvahti import TEMPLATE_DIR
+
+# Seconds between checks for changed template files
+TEMPLATE_CHECK_INTERVAL = 5
+
+# auto_reload makes Jinja2 compare the file's mtime when a template is looked up
+_env = Environment(
+    loader=FileSystemLoader(TEMPLATE_DIR),
+    autoescape=select_autoescape(["html"]),
+    auto_reload=True,
+)
+
+# Template name -> (compiled template, time of last mtime check)
+_templates = {}
+
+def get_template(template_name):
+    """Get a compiled template, recompiling it if the file has changed."""
+    now = time.monotonic()
+    cached = _templates.get(template_name)
+    if cached and now - cached[1] < TEMPLATE_CHECK_INTERVAL:
+        return cached[0]
+
+    logging.debug(f"Checking template {template_name}")
+    try:
+        template = _env.get_template(template_name)
+    except TemplateNotFound:
+        logging.error(f"Template not found: {template_name}")
+        raise FileNotFoundError(f"Template not found: {template_name}")
+
+    _templates[template_name] = (template, now)
+    return template
+
+def render_template(template_name, **context):
+    """Render a template with the given context. Values are HTML-escaped unless marked safe."""
+    return get_template(template_name).render(**context)
@@ -1,17 +1,16 @@
 """
 This module provides utility functions for the Lunch Menu Comment System.
-It includes date conversions, template loading, and comment sanitization.
+It includes date conversions, comment sanitization and atomic file writes.
 """
 
-import os
 import logging
+import os
 import re
 import html
+import threading
 
 from datetime import date, timedelta, datetime
 
-from lounasvahti import TEMPLATE_DIR
-
 WEEKDAYS = ["maanantai", "tiistai", "keskiviikko", "torstai", "perjantai", "lauantai", "sunnuntai"]
 
 def finnish_date_to_iso(finnish_date):
@@ -60,6 +59,16 @@ def get_this_week_workdays():
     logging.debug(f"This week's workdays: {workdays}")
     return [d.strftime('%Y-%m-%d') for d in workdays]
 
+def get_week_workdays(monday):
+    """
+    Get the workdays (Monday to Friday) of the week starting on the given Monday.
+    
+    :param monday: Date string in ISO format (YYYY-MM-DD)
+    :return: List of dates in ISO format
+    """
+    start = datetime.strptime(monday, "%Y-%m-%d").date()
+    return [(start + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(5)]
+
 def get_monday_and_friday(this_week=False):
     """
     Get the Monday and Friday dates for this week or next week.
@@ -101,18 +110,6 @@ def today_is(day):
     logging.debug(f"Today is {day}: {is_today}")
     return is_today
 
-def load_template(template_name):
-    """Loads an email template as a string."""
-    template_path = os.path.join(TEMPLATE_DIR, template_name)
-    logging.debug(f"Loading template from {template_path}")
-
-    if not os.path.exists(template_path):
-        logging.error(f"Template not found: {template_name}")
-        raise FileNotFoundError(f"Template not found: {template_name}")
-
-    with open(template_path, "r", encoding="utf-8") as f:
-        return f.read()
-
 def sanitize_comment(comment):
     """Removes HTML tags, trims whitespace, and ensures email-safe text."""
     if not comment:
@@ -132,3 +129,13 @@ def sanitize_comment(comment):
     sanitized_comment = clean_comment.strip()
     logging.debug(f"Sanitized comment: {sanitized_comment}")
     return sanitized_comment
+
+def write_file_atomically(path, content):
+    """
+    Write text to a file through a temporary file that replaces it, so that readers,
+    including other processes, never see a partially written file.
+    """
+    temp_file = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_file, "w", encoding="utf-8", newline="") as f:
+        f.write(content)
+    os.replace(temp_file, path)
@@ -0,0 +1,208 @@
+"""
+This script benchmarks how the scraper reads pages, without network access: the time,
+peak memory and memory blocks it takes to get the menu and state variables out of a
+response. The pages are synthetic ones with a chosen number of menu rows, as full
+pages and as partial postback responses, and optionally recorded fixtures
+(see fetch_menu --record).
+
+Results can be saved to a JSON file and compared with an earlier run, so parser
+changes can be measured before and after.
+"""
+
+import argparse
+import json
+import logging
+import statistics
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+from lounasvahti.services.fixtures import load_fixtures
+from lounasvahti.services.scraper import DELTA_START, PARSER, Scraper
+
+WEEKDAYS = ["Ma", "Ti", "Ke", "To", "Pe", "La", "Su"]
+
+PAGE = """<!DOCTYPE html>
+<html><head><title>eRuokalista</title>{styles}</head>
+<body><form method="post" action="./Default.aspx" id="form1">
+<div class="aspNetHidden">
+<input type="hidden" name="__EVENTTARGET" id="__EVENTTARGET" value="" />
+<input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="{viewstate}" />
+</div>
+<div class="aspNetHidden">
+<input type="hidden" name="__EVENTVALIDATION" id="__EVENTVALIDATION" value="{validation}" />
+</div>
+{navigation}
+<div id="MasterUpdatePanel">
+<select name="ctl00$MainContent$RestaurantTypeDropDownList">{type_options}</select>
+<select name="ctl00$MainContent$RestaurantDropDownList">{restaurant_options}</select>
+<select name="ctl00$MainContent$ShowMenuDropDownList">
+<option value="0">Tämä viikko</option><option selected="selected" value="1">Ensi viikko</option>
+</select>
+{panels}
+</div>
+</form></body></html>"""
+
+PANEL = """<div class="DayDataPanel">
+<div class="emenu_tab_panel_header">{weekday} {date}</div>
+{rows}
+</div>"""
+
+ROW = """<div class="emenu_tab_panel_row">
+<span id="MainContent_Day{day}_Row{row}_SecureLabelDish">Kasvispyörykät {row} (L, G, M)</span>
+<span id="MainContent_Day{day}_Row{row}_SecureLabelDish2">tomaattikastike, perunamuusi</span>
+<span class="emenu_nutrition">Energia {row} kcal</span>
+</div>"""
+
+def synthetic_page(rows, days=5):
+    """
+    A menu page in the markup of the site, with rows menu rows spread over days days
+    and the usual bulk of view state, dropdown options and markup the scraper skips.
+
+    :return: Tuple (page HTML, number of menu rows)
+    """
+    monday = date(2026, 1, 5)
+    per_day = [rows // days + (1 if day < rows % days else 0) for day in range(days)]
+    panels = "\n".join(
+        PANEL.format(
+            weekday=WEEKDAYS[day],
+            date=(monday + timedelta(days=day)).strftime("%d.%m.%Y"),
+            rows="\n".join(ROW.format(day=day, row=row) for row in range(count)),
+        )
+        for day, count in enumerate(per_day)
+    )
+    page = PAGE.format(
+        styles="<style>" + ".emenu { color: black; }\n" * 200 + "</style>",
+        viewstate="dDwtMTI3OTMzNDM4NDs7Pg" * 1000,
+        validation="/wEdAAYxN2J4" * 100,
+        navigation="".join(f'<div class="nav"><a href="/r/{n}">Ravintola {n}</a></div>' for n in range(200)),
+        type_options="".join(f'<option value="t{n}">Tyyppi {n}</option>' for n in range(10)),
+        restaurant_options="".join(f'<option value="r{n}">Ravintola {n}</option>' for n in range(200)),
+        panels=panels,
+    )
+    return page, sum(per_day)
+
+def synthetic_delta(rows, days=5):
+    """The same content as synthetic_page() as a partial postback delta response."""
+    page, count = synthetic_page(rows, days)
+    panel = page[page.index('<div id="MasterUpdatePanel">'):page.index("</form>")]
+    records = [
+        ("updatePanel", "ctl00_MasterUpdatePanel", panel),
+        ("hiddenField", "__EVENTTARGET", ""),
+        ("hiddenField", "__VIEWSTATE", "dDwtMTI3OTMzNDM4NDs7Pg" * 1000),
+        ("hiddenField", "__EVENTVALIDATION", "/wEdAAYxN2J4" * 100),
+        ("asyncPostBackControlIDs", "", ""),
+        ("pageTitle", "", "eRuokalista"),
+    ]
+    return "".join(f"{len(content)}|{kind}|{id_}|{content}|" for kind, id_, content in records), count
+
+def read_page(scraper, text):
+    """Read a response the way the scraper does. Returns the soup and the menu."""
+    if DELTA_START.match(text):
+        soup = scraper._parse_delta(text)
+    else:
+        soup = scraper._parse(text)
+        scraper._get_state_vars(soup)
+    return soup, scraper._find_menu_in_soup(soup)
+
+def measure(scraper, text, repeat):
+    """
+    Time reading a page repeat times, then read it once more with tracemalloc to get
+    the peak memory use and the number of memory blocks left allocated by the result.
+    """
+    _, menu = read_page(scraper, text)  # Warm up
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _, menu = read_page(scraper, text)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    result = read_page(scraper, text)
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+    del result
+
+    return {
+        "median_ms": statistics.median(times) * 1000,
+        "min_ms": min(times) * 1000,
+        "peak_kib": peak / 1024,
+        "blocks": blocks,
+        "items": sum(len(items) for items in menu.values()),
+    }
+
+def get_cases(rows, fixture_dir=None):
+    """Get the pages to benchmark as a dict mapping case names to response texts."""
+    cases = {}
+    for count in rows:
+        cases[f"page-{count}"] = synthetic_page(count)[0]
+        cases[f"delta-{count}"] = synthetic_delta(count)[0]
+    if fixture_dir:
+        for number, fixture in enumerate(load_fixtures(fixture_dir)):
+            if "DayDataPanel" in fixture["text"]:
+                cases[f"fixture-{number:04d}-{fixture['method'].lower()}"] = fixture["text"]
+    return cases
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parsing of menu pages, offline.")
+    parser.add_argument(
+        "--rows", type=int, nargs="+", default=[25, 100, 500],
+        help="Menu rows in the synthetic pages (default: 25 100 500)."
+    )
+    parser.add_argument(
+        "--fixtures", metavar="DIR", help="Also benchmark the menu pages recorded in DIR."
+    )
+    parser.add_argument(
+        "--parser", nargs="+", default=[PARSER], dest="parsers",
+        help="BeautifulSoup parser backends to compare (default: the configured one)."
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=20, help="Timed runs per page (default: 20)."
+    )
+    parser.add_argument(
+        "--save", metavar="FILE", help="Save the results as JSON."
+    )
+    parser.add_argument(
+        "--compare", metavar="FILE", help="Compare with results saved earlier with --save."
+    )
+    args = parser.parse_args()
+
+    previous = {}
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+
+    cases = get_cases(args.rows, args.fixtures)
+    results = {}
+    print(f"{'case':<28} {'parser':<12} {'items':>6} {'median ms':>10} {'min ms':>8} {'peak KiB':>9} {'blocks':>7}")
+    # Parsers that are not installed fall back to html.parser, which is only run once
+    parsers = dict.fromkeys(Scraper._select_parser(name) for name in args.parsers)
+    for parser_name in parsers:
+        scraper = Scraper(target={})
+        scraper.parser = parser_name
+        for case, text in cases.items():
+            key = f"{case} {scraper.parser}"
+            result = results[key] = measure(scraper, text, args.repeat)
+            line = (
+                f"{case:<28} {scraper.parser:<12} {result['items']:>6} {result['median_ms']:>10.2f} "
+                f"{result['min_ms']:>8.2f} {result['peak_kib']:>9.0f} {result['blocks']:>7}"
+            )
+            if key in previous:
+                change = result["median_ms"] / previous[key]["median_ms"] - 1
+                peak_change = result["peak_kib"] / previous[key]["peak_kib"] - 1
+                line += f"  time {change:+.0%}, peak {peak_change:+.0%}"
+            print(line)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+        print(f"Results saved to {args.save}")
+    logging.info(f"Benchmarked {len(cases)} pages with {len(parsers)} parsers")
+
+if __name__ == "__main__":
+    main()
@@ -39,6 +39,7 @@ def prompt_target_config():
     target_url = config["target"]["url"]
     target_url = inquirer.text(message=f"Target URL [{target_url}]") or target_url
     scraper.set_url(target_url)
+    config["target"]["url"] = target_url
     
     # Prompt for restaurant type
     restaurant_types = scraper.get_restaurant_types()
@@ -46,6 +47,7 @@ def prompt_target_config():
     restaurant_type_name = inquirer.list_input(message="Select restaurant type", choices=restaurant_types.keys(), default=restaurant_type_name)
     restaurant_type_uuid = restaurant_types[restaurant_type_name]
     scraper.set_restaurant_type(restaurant_type_name, restaurant_type_uuid)
+    config["target"]["type"] = restaurant_type_name
     
     # Prompt for restaurant
     restaurants = scraper.get_restaurants()
@@ -53,6 +55,7 @@ def prompt_target_config():
     restaurant_name = inquirer.list_input(message="Select restaurant", choices=restaurants.keys(), default=restaurant_name)
     restaurant_uuid = restaurants[restaurant_name]
     scraper.set_restaurant(restaurant_name, restaurant_uuid)
+    config["target"]["name"] = restaurant_name
 
 def prompt_service_install():
     """Ask the user if they want to install services now."""
@@ -1,10 +1,17 @@
 """
-This script fetches and prints the menu for this or next week using the Scraper service.
+This script fetches and prints the menu for this or next week, or for several weeks,
+using the Scraper service.
+Optionally, the menus of all configured restaurants are fetched, and the fetched menus
+are stored in the database. The HTTP exchanges can be recorded to fixture files, or
+replayed from them without network access.
 """
 
 import argparse
 import logging
-from lounasvahti.services.scraper import Scraper
+from lounasvahti.database import store_menu
+from lounasvahti.services import fixtures
+from lounasvahti.services.publisher import publish
+from lounasvahti.services.scraper import Scraper, scrape_all
 
 def main():
     # Parse command-line arguments
@@ -12,23 +19,65 @@ def main():
     parser.add_argument(
         "--this-week", action="store_true", help="Fetch this week's menu instead of next week's."
     )
+    parser.add_argument(
+        "--weeks", type=int, metavar="N",
+        help="Fetch the menus of N weeks starting from this week, as far as the site offers them."
+    )
+    parser.add_argument(
+        "--all", action="store_true", help="Fetch the menus of all configured restaurants."
+    )
+    parser.add_argument(
+        "--store", action="store_true", help="Store the fetched menu in the database."
+    )
+    fixture_group = parser.add_mutually_exclusive_group()
+    fixture_group.add_argument(
+        "--record", metavar="DIR", help="Record the HTTP exchanges to fixture files in DIR."
+    )
+    fixture_group.add_argument(
+        "--replay", metavar="DIR", help="Answer the requests from the fixture files in DIR instead of the site."
+    )
     args = parser.parse_args()
 
+    if args.record:
+        fixtures.enable("record", args.record)
+    elif args.replay:
+        fixtures.enable("replay", args.replay)
+
     logging.info("Starting the scraper")
 
-    # Initialize scraper and fetch menu
-    scraper = Scraper()
-    menu = scraper.get_menu(this_week=args.this_week)
+    if args.weeks:
+        weeks = range(args.weeks)
+    else:
+        weeks = [0 if args.this_week else 1]
+
+    # Initialize scraper and fetch menus; None stands for the default restaurant
+    if args.all:
+        menus = scrape_all(weeks=weeks)
+    else:
+        scraper = Scraper()
+        menus = {None: scraper.get_menus(weeks=weeks)}
 
     logging.info("Menu fetched successfully")
 
-    # Print the scraped menu
-    for date, items in menu.items():
-        print(f"{date}:")
-        for item in items:
-            print(f"  - {item}")
+    # Print the scraped menus
+    for restaurant, menu in menus.items():
+        if restaurant:
+            print(f"{restaurant}:")
+        for date, items in menu.items():
+            print(f"{date}:")
+            for item in items:
+                print(f"  - {item}")
 
     logging.info("Menu printed successfully")
 
+    if args.store:
+        for restaurant, menu in menus.items():
+            stored = store_menu(menu, restaurant)
+            print(
+                f"Stored menu: {stored['inserted']} inserted, {stored['removed']} removed, "
+                f"{stored['unchanged']} days unchanged, changed days: {', '.join(stored['changed']) or '-'}."
+            )
+        publish()
+
 if __name__ == "__main__":
     main()
@@ -83,6 +83,7 @@ def install_services():
     """
     install_or_update_service("lounasvahti-email.service.template", restart=True)  # SMTP service
     install_or_update_service("lounasvahti-web.service.template", restart=True)  # Web service
+    install_or_update_service("lounasvahti-outbox.service.template", restart=True)  # Outbound mail
     install_or_update_service("lounasvahti-daily.service.template", restart=False)
     install_or_update_service("lounasvahti-daily.timer.template", restart=False)
 
@@ -1,7 +1,7 @@
 """
 This script provides command-line interface for managing the database.
 Usage:
-    manage-db <up|drop|reset>
+    manage-db <up|migrate|drop|reset>
     manage-db <database_function> <args>
 """
 
@@ -9,7 +9,7 @@ import os
 import sys
 import logging
 from lounasvahti import config
-from lounasvahti.database import create_db, drop_db
+from lounasvahti.database import create_db, drop_db, migrate
 import lounasvahti.database as db
 
 # Get database path from configuration
@@ -23,7 +23,7 @@ if DB_DIR and not os.path.exists(DB_DIR):
 
 def main():
     if len(sys.argv) < 2:
-        print("Usage: manage-db <up|drop|reset>\n   OR: manage-db <database_function> <args>")
+        print("Usage: manage-db <up|migrate|drop|reset>\n   OR: manage-db <database_function> <args>")
         sys.exit(1)
 
     command = sys.argv[1]
@@ -31,6 +31,9 @@ def main():
     if command == "up":
         create_db()
         logging.info("Database created.")
+    elif command == "migrate":
+        version = migrate()
+        print(f"Database schema is at version {version}.")
     elif command == "drop":
         drop_db()
         logging.info("Database dropped.")
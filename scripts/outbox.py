@@ -0,0 +1,62 @@
+"""
+This script manages the outbound mail spool: it shows how many deliveries are queued,
+failed and sent, the logged delivery outcomes and the subscribers suspended for
+bouncing, and can drain, flush, retry or clean up the queue.
+"""
+
+import argparse
+import logging
+
+from lounasvahti.database import (
+    get_delivery_counts,
+    get_outbox_counts,
+    get_suspended_subscribers,
+    remove_deliveries_before,
+    remove_sent_outbox_before,
+    requeue_failed_outbox,
+)
+from lounasvahti.services.outbox import drain, run_worker
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the outbound mail spool.")
+    parser.add_argument(
+        "command", nargs="?", default="status",
+        choices=["status", "drain", "flush", "retry", "purge", "worker"],
+        help="status: show counts (default), drain: send due mail, flush: send all queued mail now, "
+             "retry: requeue failed mail, purge: remove old sent mail, worker: drain continuously"
+    )
+    parser.add_argument(
+        "--days", type=int, default=30,
+        help="Age in days of sent mail and delivery log entries to remove with purge, and of deliveries to count."
+    )
+    args = parser.parse_args()
+
+    if args.command in ("drain", "flush"):
+        sent, failed = drain(flush=args.command == "flush")
+        print(f"Sent {sent}, failed {failed}.")
+    elif args.command == "retry":
+        print(f"Requeued {requeue_failed_outbox()} failed deliveries.")
+    elif args.command == "purge":
+        print(f"Removed {remove_sent_outbox_before(args.days)} sent deliveries.")
+        print(f"Removed {remove_deliveries_before(args.days)} delivery log entries.")
+    elif args.command == "worker":
+        run_worker()
+        return
+
+    counts = get_outbox_counts()
+    print(f"Queued: {counts['queued']}, failed: {counts['failed']}, sent: {counts['sent']}")
+    logging.info(f"Outbox status: {counts}")
+
+    deliveries = get_delivery_counts(args.days)
+    print(
+        f"Last {args.days} days: {deliveries['sent']} delivered, {deliveries['failed']} failed, "
+        f"{deliveries['refused']} refused, {deliveries['bounced']} bounced"
+    )
+    suspended = get_suspended_subscribers()
+    if suspended:
+        print(f"Suspended subscribers ({len(suspended)}):")
+        for email, bounces, suspended_at in suspended:
+            print(f"  {email}: {bounces} bounces, suspended {suspended_at}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+"""
+This script regenerates the static week pages and calendar feed in the [publish]
+directory. Only the weeks whose menus or comments have changed are regenerated,
+unless --force is given.
+"""
+
+import argparse
+import logging
+
+from lounasvahti.services.publisher import PUBLISH_DIR, publish
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish the static week pages and calendar feed.")
+    parser.add_argument(
+        "--force", action="store_true", help="Regenerate all published weeks, changed or not."
+    )
+    args = parser.parse_args()
+
+    if not PUBLISH_DIR:
+        print("Publishing is disabled, set dir in the [publish] section of config.ini.")
+        return
+
+    weeks = publish(force=args.force)
+    print(f"Published weeks: {', '.join(weeks) or '-'} in {PUBLISH_DIR}")
+    logging.info(f"Published {len(weeks)} weeks")
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,23 @@
 """
-This script runs Lounasvahti's daily tasks, including scraping the menu for the next week
-and sending daily or weekly emails to subscribers.
+This script runs Lounasvahti's daily tasks, including scraping the menus of all weeks on
+offer and sending daily or weekly emails to subscribers.
 """
 
 import argparse
 import logging
-from lounasvahti.database import have_menu_for_next_week, get_subscribers, create_menu_item
-from lounasvahti.services.scraper import Scraper
+from lounasvahti.database import get_subscribers, store_menu
+from lounasvahti.services.scraper import scrape_all
 import lounasvahti.services.email_sender as email
+from lounasvahti.services.publisher import refresh_outputs
 from lounasvahti.utils import today_is
 
 def main():
     parser = argparse.ArgumentParser(description="Runs Lounasvahti's daily tasks.")
     parser.add_argument(
-        "--scrape", action="store_true", help="Scrape menu for next week"
+        "--scrape", action="store_true", help="Scrape menus for all weeks on offer (the default)"
+    )
+    parser.add_argument(
+        "--no-scrape", action="store_true", help="Use the stored menus without scraping"
     )
     parser.add_argument(
         "--for", help="Run tasks for DAY [mon-sun|ma-su]", dest="day"
@@ -23,7 +27,9 @@ def main():
     )
     args = parser.parse_args()
 
-    should_scrape = args.scrape or not have_menu_for_next_week()
+    # Scrape every day, so that menus changed after they were first stored are noticed.
+    # Days whose menus have not changed are skipped when storing.
+    should_scrape = args.scrape or not args.no_scrape
     is_sunday = today_is("sunnuntai") or (args.day and args.day.lower() in ["su", "sunnuntai", "sun", "sunday"])
     is_saturday = today_is("lauantai") or (args.day and args.day.lower() in ["la", "lauantai", "sat", "saturday"])
     dry_run = args.dry_run
@@ -31,13 +37,16 @@ def main():
     logging.info("Running daily task.")
     
     if should_scrape:
-        logging.debug("Scraping menu for next week.")
-        scraper = Scraper()
-        menu = scraper.get_menu()
-        for date, items in menu.items():
-            for item in items:
-                logging.debug(f"Creating menu item for {date}: {item}")
-                create_menu_item(date, item)
+        logging.debug("Scraping menus for all weeks on offer.")
+        for restaurant, menu in scrape_all().items():
+            stored = store_menu(menu, restaurant)
+            logging.info(
+                f"Scraped menu for {restaurant} stored: {stored['inserted']} items added, "
+                f"{stored['removed']} removed, {stored['unchanged']} days unchanged."
+            )
+
+    # Also rolls the published pages over to the new week
+    refresh_outputs()
 
     if is_sunday:
         logging.info("Today is Sunday, no emails will be sent.")
@@ -49,6 +58,10 @@ def main():
         logging.warning("No subscribers found.")
         return
 
+    if should_scrape:
+        logging.info("Sending menu update email for changed menus, if any.")
+        email.send_menu_update_mail(subscribers, dry_run=dry_run)
+
     if is_saturday:
         logging.info("Today is Saturday, sending weekly email.")
         email.send_weekly_mail(subscribers, dry_run=dry_run)